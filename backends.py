@@ -0,0 +1,226 @@
+"""
+Sensor backends: the report loop reads a BNO08x through the small interface
+of sensorBackend, so that the same pipeline runs on the real sensor
+(i2cBackend, Adafruit CircuitPython BNO08x library) or on a synthetic one
+(simBackend) on a machine without I2C bus and sensor (CI, dev laptop, benchmarks).
+"""
+
+import time, random
+
+from math import sin, cos, pi
+
+try:
+    import adafruit_bno08x
+    from adafruit_bno08x import (
+        BNO_REPORT_ACCELEROMETER,
+        BNO_REPORT_GYROSCOPE,
+        BNO_REPORT_MAGNETOMETER,
+        BNO_REPORT_ROTATION_VECTOR,
+        BNO_REPORT_GAME_ROTATION_VECTOR,
+        REPORT_ACCURACY_STATUS,
+    )
+    from adafruit_bno08x.i2c import BNO08X_I2C
+except ImportError: # no Blinka/sensor library: only the simulated backend is available
+    BNO08X_I2C = None
+    # same values of the adafruit_bno08x library
+    BNO_REPORT_ACCELEROMETER = 0x01
+    BNO_REPORT_GYROSCOPE = 0x02
+    BNO_REPORT_MAGNETOMETER = 0x03
+    BNO_REPORT_ROTATION_VECTOR = 0x05
+    BNO_REPORT_GAME_ROTATION_VECTOR = 0x08
+    REPORT_ACCURACY_STATUS = [
+        "Accuracy Unreliable",
+        "Low Accuracy",
+        "Medium Accuracy",
+        "High Accuracy",
+    ]
+
+class sensorBackend():
+    """
+    What the plugin uses of a BNO08x: the readings (as the properties of the
+    adafruit BNO08X class) and the few commands sent to the sensor.
+    """
+    @property
+    def game_quaternion(self):
+        """ (i, j, k, real) """
+        raise NotImplementedError
+
+    @property
+    def magnetic(self):
+        """ (x, y, z) micro Tesla """
+        raise NotImplementedError
+
+    @property
+    def gyro(self):
+        """ (x, y, z) rad/s, counterclockwise """
+        raise NotImplementedError
+
+    @property
+    def acceleration(self):
+        """ (x, y, z) m/s^2, gravity included """
+        raise NotImplementedError
+
+    @property
+    def calibration_status(self):
+        """ 0..3, index of REPORT_ACCURACY_STATUS """
+        raise NotImplementedError
+
+    def enable_feature(self, feature_id, report_interval = None):
+        """ report_interval in microseconds, None for the sensor default """
+        raise NotImplementedError
+
+    def begin_calibration(self):
+        raise NotImplementedError
+
+    def save_calibration_data(self):
+        raise NotImplementedError
+
+class i2cBackend(sensorBackend):
+    """ BNO08x on the I2C bus through the adafruit library """
+    def __init__(self, i2c, address):
+        if BNO08X_I2C is None:
+            raise ImportError("adafruit_bno08x library not installed")
+        self.bno = BNO08X_I2C(i2c, reset=None , address= address, debug=False)
+
+    @property
+    def game_quaternion(self):
+        return self.bno.game_quaternion
+
+    @property
+    def magnetic(self):
+        return self.bno.magnetic
+
+    @property
+    def gyro(self):
+        return self.bno.gyro
+
+    @property
+    def acceleration(self):
+        return self.bno.acceleration
+
+    @property
+    def calibration_status(self):
+        return self.bno.calibration_status
+
+    def enable_feature(self, feature_id, report_interval = None):
+        if report_interval is None:
+            self.bno.enable_feature(feature_id)
+            return
+        try:
+            self.bno.enable_feature(feature_id, report_interval)
+        except TypeError: # library version without report interval: sensor default (50 ms)
+            self.bno.enable_feature(feature_id)
+
+    def begin_calibration(self):
+        self.bno.begin_calibration()
+
+    def save_calibration_data(self):
+        self.bno.save_calibration_data()
+
+GRAVITY = 9.80665 # m/s^2
+
+def quaternion_from_attitude(roll, pitch, heading):
+    """
+    Inverse of plugin.find_attitude: (i, j, k, real) of the game rotation
+    vector giving roll, pitch (radians, clockwise) and heading (radians
+    clockwise from 0 to 2*pi).
+    """
+    hr = -roll / 2 # find_attitude reports the opposite of the raw angles
+    hp = -pitch / 2
+    hy = -heading / 2
+    cr, sr = cos(hr), sin(hr)
+    cp, sp = cos(hp), sin(hp)
+    cy, sy = cos(hy), sin(hy)
+    return (sr * cp * cy - cr * sp * sy,
+            cr * sp * cy + sr * cp * sy,
+            cr * cp * sy - sr * sp * cy,
+            cr * cp * cy + sr * sp * sy)
+
+class simBackend(sensorBackend):
+    """
+    Synthetic BNO08x: a boat turning at 'turnRate' degrees/sec while rolling
+    and pitching on a sinusoidal swell, with optional gaussian noise (degrees).
+    Gyro and accelerometer follow the same motion (small angles, gravity only).
+    The sensor produces a new report every 1/reportRate secs on its own clock
+    (not aligned with the reads): readings in between return the last report,
+    as the real sensor does. The calibration
+    status climbs from 0 to 3 in 'calibrationTime' secs.
+    """
+    def __init__(self, reportRate = 100, turnRate = 3.0, rollAmplitude = 10.0, rollPeriod = 6.0,
+                 pitchAmplitude = 4.0, pitchPeriod = 4.5, noise = 0.0, calibrationTime = 2.0, seed = None):
+        self.interval = 1 / reportRate
+        self.turnRate = turnRate * pi/180
+        self.rollAmplitude = rollAmplitude * pi/180
+        self.rollPeriod = rollPeriod
+        self.pitchAmplitude = pitchAmplitude * pi/180
+        self.pitchPeriod = pitchPeriod
+        self.noise = noise * pi/180
+        self.calibrationTime = calibrationTime
+        self.random = random.Random(seed)
+        self.features = set()
+        self.start = self.clock = time.monotonic()
+        self.report = None # number of the last report on the sensor clock
+        self._update()
+
+    def _update(self):
+        report = int((time.monotonic() - self.clock) / self.interval)
+        if report == self.report:
+            return
+        self.report = report
+        t = self.clock + report * self.interval - self.start # time of the report
+        noise = self.random.gauss
+        roll = self.rollAmplitude * sin(2*pi * t / self.rollPeriod)
+        pitch = self.pitchAmplitude * sin(2*pi * t / self.pitchPeriod)
+        heading = self.turnRate * t
+        if self.noise:
+            roll += noise(0.0, self.noise)
+            pitch += noise(0.0, self.noise)
+            heading += noise(0.0, self.noise)
+        heading %= 2*pi
+        self._quaternion = quaternion_from_attitude(roll, pitch, heading)
+        # 20 uT horizontal field (to the North) and 40 uT vertical, heading only
+        self._magnetic = (20.0 * cos(heading), -20.0 * sin(heading), -40.0)
+        # raw angles are the opposite of the reported ones (see quaternion_from_attitude)
+        self._gyro = (-self.rollAmplitude * 2*pi / self.rollPeriod * cos(2*pi * t / self.rollPeriod),
+                      -self.pitchAmplitude * 2*pi / self.pitchPeriod * cos(2*pi * t / self.pitchPeriod),
+                      -self.turnRate)
+        self._acceleration = (GRAVITY * sin(-pitch), -GRAVITY * sin(-roll) * cos(pitch), GRAVITY * cos(roll) * cos(pitch))
+        self._calibration = min(3, int(3 * t / self.calibrationTime)) if self.calibrationTime else 3
+
+    @property
+    def game_quaternion(self):
+        self._update()
+        return self._quaternion
+
+    @property
+    def magnetic(self):
+        self._update()
+        return self._magnetic
+
+    @property
+    def gyro(self):
+        self._update()
+        return self._gyro
+
+    @property
+    def acceleration(self):
+        self._update()
+        return self._acceleration
+
+    @property
+    def calibration_status(self):
+        self._update()
+        return self._calibration
+
+    def enable_feature(self, feature_id, report_interval = None):
+        self.features.add(feature_id)
+        if feature_id == BNO_REPORT_GAME_ROTATION_VECTOR and report_interval:
+            self.interval = report_interval / 1e6
+            self.clock = time.monotonic() # the reports restart on the new interval
+            self.report = None
+
+    def begin_calibration(self):
+        pass
+
+    def save_calibration_data(self):
+        pass
@@ -0,0 +1,51 @@
+"""
+Scalar find_attitude vs NumPy find_attitude_batch:
+
+    python3 bench/bench_attitude.py [-n N [N ...]]
+
+For each N random quaternions both conversions are timed and their results
+compared (angles compared modulo 2*pi): the run fails if they differ by more
+than TOLERANCE radians.
+"""
+
+import os, sys, time, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import plugin
+
+TOLERANCE = 1e-9
+
+def angleDiff(a, b):
+    return np.abs((a - b + np.pi) % (2*np.pi) - np.pi)
+
+def main():
+    parser = argparse.ArgumentParser(description = "find_attitude scalar vs batch benchmark")
+    parser.add_argument("-n", "--samples", type = int, nargs = '+', default = [100000, 1000000])
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    find_attitude = plugin.find_attitude
+    print("{:>9s}{:>12s}{:>12s}{:>10s}{:>14s}".format("N", "scalar s", "batch s", "speedup", "max diff rad"))
+    for n in args.samples:
+        q = rng.normal(size = (n, 4)) # w, x, y, z
+        q[:8] = [[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1], # singular/boundary cases
+                 [0.5, 0.5, 0.5, 0.5], [0.5, -0.5, 0.5, -0.5], [np.sqrt(0.5), 0, np.sqrt(0.5), 0], [-1, 0, 0, 0]]
+        rows = q.tolist()
+        start = time.perf_counter()
+        scalar = [find_attitude(w, x, y, z) for w, x, y, z in rows]
+        scalarTime = time.perf_counter() - start
+        start = time.perf_counter()
+        batch = plugin.find_attitude_batch(q)
+        batchTime = time.perf_counter() - start
+        scalar = np.array(scalar).T
+        diff = max(angleDiff(scalar[i], batch[i]).max() for i in range(3))
+        print("{:>9d}{:>12.3f}{:>12.4f}{:>9.0f}x{:>14.2e}".format(n, scalarTime, batchTime, scalarTime / batchTime, diff))
+        if diff > TOLERANCE:
+            sys.exit("find_attitude_batch differs from find_attitude")
+        if ((batch[2] < 0) | (batch[2] > 2*np.pi)).any():
+            sys.exit("find_attitude_batch yaw out of 0..2*pi")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Per-stage benchmark of the report loop on the simulated BNO08x backend
+(no I2C bus nor sensor needed):
+
+    python3 bench/bench_pipeline.py [-n SAMPLES] [-t SECONDS]
+
+Each stage of a sample (read, find_attitude, offsets/deviation, emission
+policy, telemetry, delta serialization, stdout write) is timed separately over SAMPLES
+calls, then sensorReportLoop runs unthrottled (deadbands disabled, every
+sample sent) for SECONDS to measure the end-to-end samples per second
+output by the consumer thread; the acquisition thread reads the sensor
+continuously, so the samples it cannot hand over are counted as dropped.
+The read stage times the simulated sensor: on the real one it is dominated
+by the I2C transfers.
+"""
+
+import os, sys, time, threading, argparse, logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plugin
+from backends import simBackend
+
+OPTIONS = {"devName": 75, "devRefresh": 10, "devDelayReports": 0, "devCalibRequired": False,
+           "devDeclRequired": True, "devDeclInterval": 5, "devDeclEstimate": 3,
+           "devHdgOffset": 1.5, "devHdgDeviation": 0, "devRollOffset": 0.5, "devPitchOffset": -0.5,
+           "devDeadbandHeading": 0, "devDeadbandAttitude": 0,
+           "devDeviationTable": [{"heading": h, "deviation": 2.0 if h % 90 else -1.0} for h in range(0, 360, 45)]}
+
+class countingStream():
+    """ stdout replacement counting the written deltas """
+    def __init__(self, sink):
+        self.sink = sink
+        self.lines = 0
+
+    def write(self, text):
+        self.lines += 1
+        return self.sink.write(text)
+
+    def flush(self):
+        self.sink.flush()
+
+def timeStage(name, fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn()
+    elapsed = time.perf_counter() - start
+    print("{:<24s}{:>12.2f} us{:>14.0f} /s".format(name, elapsed / n * 1e6, n / elapsed))
+
+def main():
+    parser = argparse.ArgumentParser(description = "report loop benchmark (simulated BNO08x)")
+    parser.add_argument("-n", "--samples", type = int, default = 20000, help = "calls timed per stage")
+    parser.add_argument("-t", "--seconds", type = float, default = 3.0, help = "duration of the end-to-end run")
+    args = parser.parse_args()
+    n = args.samples
+    logging.disable(logging.CRITICAL)
+
+    dCfg = plugin.pluginConfigFromOptions(OPTIONS)
+    dCfg.source = 'SIM_at[0x4b]'
+    bno = simBackend(reportRate = 1e6) # a new report at every read
+    busLock = threading.Lock()
+    template = plugin.skTemplate(dCfg.source)
+    devnull = open(os.devnull, 'w')
+
+    quat = plugin.readSample(bno, busLock)
+    i, j, k, real = quat
+    roll, pitch, yaw = plugin.find_attitude(real, i, j, k)
+    corrected = plugin.applyCorrections(dCfg, roll, pitch, yaw)
+    values = plugin.attitudeValues(dCfg, *corrected)
+    line = template.dumps(values) + '\n'
+
+    print("{:<24s}{:>15s}{:>16s}".format("stage (" + str(n) + " calls)", "per call", "rate"))
+    timeStage("read (simulated)", lambda: plugin.readSample(bno, busLock), n)
+    timeStage("find_attitude", lambda: plugin.find_attitude(real, i, j, k), n)
+    timeStage("offsets/deviation", lambda: plugin.applyCorrections(dCfg, roll, pitch, yaw), n)
+    timeStage("delta values", lambda: plugin.attitudeValues(dCfg, *corrected), n)
+    emission = plugin.emissionPolicyFromOptions({"devDeadbandHeading": 0.2, "devDeadbandAttitude": 0.5})
+    timeStage("emission policy", lambda: emission.filter(values, time.monotonic()), n)
+    perf = plugin.perfMonitor(dCfg.source, 60)
+    timeStage("telemetry", lambda: perf.sample(1e-4, 2e-4, 0.0), n)
+    timeStage("delta serialization", lambda: template.dumps(values), n)
+    timeStage("stdout write", lambda: (devnull.write(line), devnull.flush()), n)
+
+    # end-to-end: the report loop with a period far shorter than a sample
+    stream = plugin.skStream = countingStream(devnull)
+    OPTIONS_E2E = dict(OPTIONS, devRefresh = 1e6)
+    dCfg = plugin.pluginConfigFromOptions(OPTIONS_E2E)
+    dCfg.source = 'SIM_at[0x4b]'
+    threading.Thread(target = plugin.sensorReportLoop, args = (bno, dCfg, busLock), daemon = True).start()
+    time.sleep(args.seconds)
+    print("{:<24s}{:>15.0f} samples/s".format("end-to-end", stream.lines / args.seconds))
+    print("{:<24s}{:>15d} samples".format("dropped (ring full)", dCfg.ring.overflows))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Startup benchmark of the plugin on the simulated BNO08x backend:
+
+    python3 bench/bench_startup.py [-r RUNS]
+
+Import time is the time to import plugin.py in a fresh interpreter (the
+modules it loads at startup only); time to first heading is the time from
+the start of plugin.py, fed with a one device configuration on stdin, to
+its first delta carrying navigation.headingMagnetic on stdout (telemetry
+deltas are not counted). Medians of RUNS runs. The plugin runs in a
+temporary directory (debug.log, calibration.log).
+"""
+
+import os, sys, time, json, subprocess, tempfile, statistics, argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG = {"imuDevices": [{"devName": 75, "devBackend": "sim", "devRefresh": 10, "devDelayReports": 0,
+                          "devCalibRequired": True, "devDeclRequired": True, "devDeclInterval": 5,
+                          "devDeclEstimate": 3, "devHdgOffset": 0, "devHdgDeviation": 0,
+                          "devRollOffset": 0, "devPitchOffset": 0}]}
+
+IMPORT = "import sys, time; sys.path.insert(0, {!r}); start = time.perf_counter(); import plugin; " \
+         "print(time.perf_counter() - start); print(' '.join(m for m in ('requests', 'ujson', 'wmm') if m in sys.modules))"
+
+def importTime():
+    out = subprocess.run([sys.executable, "-c", IMPORT.format(ROOT)], capture_output = True, text = True, check = True)
+    elapsed, modules = out.stdout.split('\n')[:2]
+    return float(elapsed), modules
+
+def firstDelta(cwd):
+    start = time.perf_counter()
+    child = subprocess.Popen([sys.executable, os.path.join(ROOT, "plugin.py")], cwd = cwd, text = True,
+                             stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL)
+    child.stdin.write(json.dumps(CONFIG) + '\n')
+    child.stdin.flush()
+    line = ''
+    for line in child.stdout: # telemetry or status deltas do not count
+        if '"navigation.headingMagnetic"' in line:
+            break
+    elapsed = time.perf_counter() - start
+    child.kill()
+    child.wait()
+    if '"navigation.headingMagnetic"' not in line:
+        sys.exit("no heading from plugin.py")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description = "plugin startup benchmark (simulated BNO08x)")
+    parser.add_argument("-r", "--runs", type = int, default = 5)
+    args = parser.parse_args()
+    imports = [importTime() for i in range(args.runs)]
+    with tempfile.TemporaryDirectory() as cwd:
+        deltas = [firstDelta(cwd) for i in range(args.runs)]
+    print("{:<36s}{:>10.1f} ms".format("import plugin", statistics.median(t for t, m in imports) * 1e3))
+    print("{:<36s}{:>13s}".format("  network/model modules loaded", imports[0][1] or "none"))
+    print("{:<36s}{:>10.1f} ms".format("time to first heading", statistics.median(deltas) * 1e3))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+World Magnetic Model check against the official test values, and timing:
+
+    python3 bench/bench_wmm.py [-n N]
+
+The declination of wmm.py is compared with the WMM2025 test values published
+by NOAA/NCEI with the model (WMM2025_TEST_VALUES.txt): the run fails if it
+differs by more than TOLERANCE degrees from the declination of the table
+(rounded to 0.01 degrees) or by more than TOLERANCE_XY degrees from the one
+given by its X and Y components (rounded to 0.1 nT). Then N model
+evaluations and 10*N lookups of cached cells (wmm.declination) are timed.
+"""
+
+import os, sys, time, random, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from math import atan2, degrees
+
+import wmm
+
+TOLERANCE = 0.005 # half the last digit of D
+TOLERANCE_XY = 0.001
+
+# WMM2025_TEST_VALUES.txt: date, height above the WGS84 ellipsoid (km), geodetic
+# latitude and longitude (degrees), X (nT), Y (nT), declination D (degrees)
+TEST_VALUES = [
+    (2025.0,   0.0,  80.0,   0.0,  6521.6,   145.9,  1.28),
+    (2025.0,   0.0,   0.0, 120.0, 39677.8,  -109.6, -0.16),
+    (2025.0,   0.0, -80.0, 240.0,  6117.5, 15751.9, 68.78),
+    (2025.0, 100.0,  80.0,   0.0,  6216.0,    92.4,  0.85),
+    (2025.0, 100.0,   0.0, 120.0, 37688.6,   -96.2, -0.15),
+    (2025.0, 100.0, -80.0, 240.0,  5907.6, 14780.3, 68.21),
+    (2027.5,   0.0,  80.0,   0.0,  6500.8,   294.5,  2.59),
+    (2027.5,   0.0,   0.0, 120.0, 39701.6,  -167.4, -0.24),
+    (2027.5,   0.0, -80.0, 240.0,  6200.7, 15730.3, 68.49),
+    (2027.5, 100.0,  80.0,   0.0,  6196.7,   233.8,  2.16),
+    (2027.5, 100.0,   0.0, 120.0, 37711.5,  -148.7, -0.23),
+    (2027.5, 100.0, -80.0, 240.0,  5984.0, 14760.1, 67.93),
+]
+
+def check(model):
+    print("{:>7s}{:>7s}{:>7s}{:>7s}{:>10s}{:>10s}{:>10s}{:>10s}".format("date", "km", "lat", "lon", "D", "wmm.py", "diff D", "diff XY"))
+    failed = 0
+    for year, alt, lat, lon, x, y, d in TEST_VALUES:
+        computed = degrees(model.declination(lat, lon, year, alt))
+        diff = computed - d
+        diffXY = computed - degrees(atan2(y, x))
+        ok = abs(diff) <= TOLERANCE and abs(diffXY) <= TOLERANCE_XY
+        failed += not ok
+        print("{:>7.1f}{:>7.0f}{:>7.0f}{:>7.0f}{:>10.2f}{:>10.4f}{:>10.4f}{:>10.4f}{}".format(year, alt, lat, lon, d, computed,
+                                                                                      diff, diffXY, "" if ok else "  FAILED"))
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description = "World Magnetic Model test values and timing")
+    parser.add_argument("-n", "--samples", type = int, default = 1000)
+    args = parser.parse_args()
+    model = wmm.model()
+    failed = check(model)
+    rng = random.Random(0)
+    positions = [(rng.uniform(-80, 80), rng.uniform(-180, 180)) for i in range(args.samples)]
+    year = model.epoch + 1
+    start = time.perf_counter()
+    for lat, lon in positions:
+        model.declination(lat, lon, year)
+    elapsed = time.perf_counter() - start
+    print("{:<24s}{:>12.1f} us".format("model evaluation", elapsed / args.samples * 1e6))
+    for lat, lon in positions: # cells computed once, then looked up
+        wmm.declination(lat, lon, year)
+    start = time.perf_counter()
+    for lat, lon in positions * 10:
+        wmm.declination(lat, lon, year)
+    elapsed = time.perf_counter() - start
+    print("{:<24s}{:>12.2f} us".format("cached lookup", elapsed / (10 * args.samples) * 1e6))
+    if failed:
+        sys.exit(str(failed) + " test values not matched")
+
+if __name__ == '__main__':
+    main()
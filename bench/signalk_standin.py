@@ -0,0 +1,142 @@
+"""
+Stand-in Signal K server, to test the plugin declination without a boat:
+
+    python3 bench/signalk_standin.py [--port 3000] [--lat 43.7] [--lon 10.4] [--rate 1]
+
+It serves the REST endpoints read by the plugin (navigation/position and
+navigation/magneticVariation of vessels.self) and the websocket stream
+/signalk/v1/stream, pushing the position of a vessel sailing East at
+6 knots 'rate' times per second and a magneticVariation (source
+'standin.gps') every 10 secs. REST requests and stream clients are counted
+and printed every 10 secs, e.g. to check that the plugin does not poll.
+"""
+
+import os, sys, json, time, socketserver, threading, argparse
+
+from math import cos, radians
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from skstream import wsFrame, wsReadFrame, wsAccept, wsClosed
+
+API = '/signalk/v1/api/vessels/self/'
+SOURCE = 'standin.gps'
+SPEED = 6 * 1852 / 3600 # m/s
+VARIATION = 0.0436 # rad
+
+class vessel():
+    def __init__(self, lat, lon):
+        self.lat = lat
+        self.lon = lon
+        self.start = time.monotonic()
+        self.restRequests = 0
+        self.streamClients = 0
+        self.lock = threading.Lock()
+
+    def position(self):
+        east = SPEED * (time.monotonic() - self.start) # metres
+        return {'latitude': self.lat, 'longitude': self.lon + east / (111320 * cos(radians(self.lat)))}
+
+    def delta(self, path, value):
+        return {'context': 'vessels.urn:mrn:imo:mmsi:000000000',
+                'updates': [{'$source': SOURCE, 'source': {'label': 'standin'},
+                             'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+                             'values': [{'path': path, 'value': value}]}]}
+
+class handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = self.rfile.readline().decode('latin-1').split()
+        headers = {}
+        while True:
+            line = self.rfile.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.partition(b':')
+            headers[name.strip().lower()] = value.strip()
+        if len(request) < 2:
+            return
+        path = request[1]
+        if path.startswith('/signalk/v1/stream') and headers.get(b'upgrade', b'').lower() == b'websocket':
+            self.stream(headers[b'sec-websocket-key'])
+        else:
+            self.rest(path)
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.wfile.write(b'HTTP/1.1 ' + status + b'\r\nContent-Type: application/json\r\n'
+                         b'Content-Length: ' + str(len(data)).encode() + b'\r\nConnection: close\r\n\r\n' + data)
+
+    def rest(self, path):
+        boat = self.server.vessel
+        with boat.lock:
+            boat.restRequests += 1
+        values = {'navigation/position/value': boat.position(),
+                  'navigation/magneticVariation/$source': SOURCE,
+                  'navigation/magneticVariation/value': VARIATION,
+                  'navigation/magneticVariation/values': {SOURCE: {'value': VARIATION}}}
+        key = path[len(API):] if path.startswith(API) else None
+        if key in values:
+            self.reply(b'200 OK', values[key])
+        else:
+            self.reply(b'404 Not Found', {'message': 'not found'})
+
+    def stream(self, key):
+        boat = self.server.vessel
+        self.wfile.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                         b'Sec-WebSocket-Accept: ' + wsAccept(key) + b'\r\n\r\n')
+        with boat.lock:
+            boat.streamClients += 1
+        threading.Thread(target=self.subscriptions, daemon=True).start()
+        send = lambda message: self.wfile.write(wsFrame(json.dumps(message).encode(), mask = False))
+        try:
+            send({'name': 'signalk-standin', 'version': '2.0.0', 'self': 'vessels.urn:mrn:imo:mmsi:000000000', 'roles': ['master']})
+            n = 0
+            while True:
+                send(boat.delta('navigation.position', boat.position()))
+                if n % max(1, int(10 * self.server.rate)) == 0:
+                    send(boat.delta('navigation.magneticVariation', VARIATION))
+                n += 1
+                time.sleep(1 / self.server.rate)
+        except OSError:
+            pass
+        finally:
+            with boat.lock:
+                boat.streamClients -= 1
+
+    def subscriptions(self):
+        # messages of the client (subscriptions), printed
+        try:
+            while True:
+                fin, opcode, payload = wsReadFrame(self.rfile)
+                if opcode == 0x8:
+                    return
+                if opcode == 0x1:
+                    print("stream client: " + payload.decode(), file = sys.stderr)
+        except (OSError, wsClosed):
+            pass
+
+class server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+def main():
+    parser = argparse.ArgumentParser(description = "stand-in Signal K server (position, magneticVariation)")
+    parser.add_argument("--port", type = int, default = 3000)
+    parser.add_argument("--lat", type = float, default = 43.7)
+    parser.add_argument("--lon", type = float, default = 10.4)
+    parser.add_argument("--rate", type = float, default = 1.0, help = "position deltas per second on the stream")
+    args = parser.parse_args()
+    httpd = server(('localhost', args.port), handler)
+    httpd.vessel = vessel(args.lat, args.lon)
+    httpd.rate = args.rate
+    threading.Thread(target = httpd.serve_forever, daemon = True).start()
+    print("stand-in Signal K server on port " + str(args.port), file = sys.stderr)
+    try:
+        while True:
+            time.sleep(10)
+            print("REST requests: {}  stream clients: {}".format(httpd.vessel.restRequests, httpd.vessel.streamClients), file = sys.stderr)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -4,26 +4,77 @@ const schema = require('./schema')
 
 const pkgData = require('./package.json')
 
+// when the plugin is restarted with new options (Signal K calls stop() then start()) the
+// running process is kept for this long, to receive the new options on its stdin
+const RESTART_GRACE = 1000 // ms
+
+// options that need a new process (devices, backends, files, pins, output setup): all the
+// other ones (offsets, deviation, rates, declination, deadbands) are applied live
+const RESTART_DEVICE_OPTIONS = ['devName', 'devBackend', 'devReplayFile', 'devRecordFile', 'devIntPin', 'devCalibRequired', 'devPerfInterval']
+const RESTART_OPTIONS = ['outputFrameDeltas', 'outputFrameInterval', 'skStream']
+
+function restartNeeded (oldOptions, newOptions) {
+  const key = options => JSON.stringify([
+    (options.imuDevices || []).map(device => RESTART_DEVICE_OPTIONS.map(name => device[name])),
+    RESTART_OPTIONS.map(name => options[name])
+  ])
+  return key(oldOptions) !== key(newOptions)
+}
+
 module.exports = function (app) {
   let child
+  let childOptions
+  let stopTimer
+
+  function kill () {
+    clearTimeout(stopTimer)
+    stopTimer = undefined
+    if (child) {
+      process.kill(child.pid)
+      child = undefined
+    }
+  }
+
  return {
     start: options => {
+      if (child && stopTimer && !restartNeeded(childOptions, options)) {
+        // same devices: the running process applies the new options between two samples
+        clearTimeout(stopTimer)
+        stopTimer = undefined
+        childOptions = options
+        child.stdin.write(JSON.stringify(options))
+        child.stdin.write('\n')
+        return
+      }
+      kill()
       const MY_PYTHON_ENV= "/home/pi/.env"	
       let MY_PYTHON = MY_PYTHON_ENV + '/bin/python3'
-      child = spawn(MY_PYTHON, ['plugin.py'], { cwd: __dirname })
+      const proc = child = spawn(MY_PYTHON, ['plugin.py'], { cwd: __dirname })
+      childOptions = options
+      proc.on('exit', () => {
+        if (child === proc) {
+          child = undefined
+        }
+      })
 
+      // one delta per line: a line can be split across chunks (and a chunk can
+      // carry several deltas), the incomplete tail is kept for the next chunk
+      let pending = ''
+      child.stdout.setEncoding('utf8')
       child.stdout.on('data', data => {
-        // app.debug(data.toString())
-        try {
-          data.toString().split(/\r?\n/).forEach(line => {
-            // console.log(JSON.stringify(line))
-            if (line.length > 0) {
+        // app.debug(data)
+        const lines = (pending + data).split('\n')
+        pending = lines.pop()
+        lines.forEach(line => {
+          line = line.trim()
+          if (line.length > 0) {
+            try {
               app.handleMessage(undefined, JSON.parse(line))
+            } catch (e) {
+              console.error(e.message)
             }
-          })
-        } catch (e) {
-          console.error(e.message)
-        }
+          }
+        })
       })
 
       child.stderr.on('data', fromChild => {
@@ -38,9 +89,8 @@ module.exports = function (app) {
       child.stdin.write('\n')
     },
     stop: () => {
-      if (child) {
-        process.kill(child.pid)
-        child = undefined
+      if (child && !stopTimer) {
+        stopTimer = setTimeout(kill, RESTART_GRACE)
       }
     },
     schema,
@@ -23,30 +23,35 @@ SOFTWARE.
 
 """
 
-import sys, json, datetime, logging, os, time;
+import sys, json, datetime, logging, os, time, threading, collections, atexit, signal, queue;
 
-import ujson, requests
+# requests, ujson (declination) and wmm (World Magnetic Model) are imported when first
+# needed: a device without declination does not pay their import time at startup
 
-from urllib.request import urlopen
+from array import array
+from bisect import bisect_right
 
-from math import atan2, asin, pi, sqrt
+from math import atan2, asin, pi, sqrt, sin, cos
 
-import board
-import busio
+try: # Adafruit Blinka (CircuitPython compatibility layer)
+    import board
+    import busio
+    from micropython import const
+except ImportError: # not installed: only simulated devices ('devBackend' = 'sim') can be used
+    board = busio = None
+    def const(x):
+        return x
 
-from digitalio import DigitalInOut
-
-import adafruit_bno08x
-from adafruit_bno08x import (
+from backends import (
     BNO_REPORT_ACCELEROMETER,
     BNO_REPORT_GYROSCOPE,
     BNO_REPORT_MAGNETOMETER,
     BNO_REPORT_ROTATION_VECTOR,
     BNO_REPORT_GAME_ROTATION_VECTOR,
+    REPORT_ACCURACY_STATUS,
+    i2cBackend,
+    simBackend,
 )
-from adafruit_bno08x.i2c import BNO08X_I2C
-
-from micropython import const
 
 _BNO08X_DEFAULT_ADDRESS = const(0x4A)
 _BNO08X_ALTERNATIVE_ADDRESS = const(0x4B)
@@ -60,17 +65,59 @@ def scan_for_bno(i2c):
     #print("I2C devices found: ", [hex(i) for i in devices], file = sys.stderr)
     for i in devices:
         logger.info ("I2C devices found: [" + hex(i) + "]")
-    if _BNO08X_ALTERNATIVE_ADDRESS in devices:
-      address=_BNO08X_ALTERNATIVE_ADDRESS
-    elif _BNO08X_DEFAULT_ADDRESS in devices:
-      address=_BNO08X_DEFAULT_ADDRESS
-    else:
-      i2c.unlock # Anyway unlock the bus
-      raise ValueError("NO VALID BNO08X ADDRESS FOUND IN THE I2C BUS")
-
     # Unlock the bus
     i2c.unlock()
-    return address
+    addresses = [a for a in (_BNO08X_ALTERNATIVE_ADDRESS, _BNO08X_DEFAULT_ADDRESS) if a in devices]
+    if not addresses:
+      raise ValueError("NO VALID BNO08X ADDRESS FOUND IN THE I2C BUS")
+    return addresses
+
+def assignAddresses(names, addresses):
+    """
+    Bus address of each configured i2c device ('devName', in config order),
+    None when the device is ignored: the exact matches first, then the
+    addresses left go to the devices configured with an address not found.
+    """
+    assigned = [None] * len(names)
+    mismatched = []
+    for k, name in enumerate(names):
+        if name not in addresses :
+            mismatched.append(k)
+        elif name in assigned :
+            logger.critical("DEVICE AT '" + hex(name) + "' CONFIGURED TWICE: DEVICE IGNORED")
+        else :
+            assigned[k] = name
+    for k in mismatched:
+        free = [a for a in addresses if a not in assigned]
+        if not free :
+            logger.critical("NO BNO08X FOUND FOR THE CONFIGURED ADDRESS '" + hex(names[k]) + "': DEVICE IGNORED")
+            continue
+        assigned[k] = free[0]
+        logger.critical("THE CONFIGURED ADDRESS VALUE '" + hex(names[k]) + "'" +" IS DIFFERENT FROM THE ONE FOUND --> '" + hex(free[0]) + "'")
+    return assigned
+
+BUS_ALIVE = 5.0 # secs since the last good read of a device for the bus to be considered working
+
+class i2cBus():
+    """
+    The I2C bus shared by the devices, re-created when a device cannot be
+    brought back on it and no other device can read it either: the devices
+    reconnect on the current busio object.
+    """
+    def __init__(self):
+        self.i2c = busio.I2C(board.SCL, board.SDA)
+        self.devices = [] # pluginConfig of the devices on the bus
+
+    def inUse(self, dCfg, now):
+        # another device is reading the bus: the fault is of the sensor, not of the bus
+        return any(c is not dCfg and c.last_read is not None and now - c.last_read < BUS_ALIVE for c in self.devices)
+
+    def reopen(self):
+        try:
+            self.i2c.deinit()
+        except Exception: # the old bus is being replaced anyway
+            pass
+        self.i2c = busio.I2C(board.SCL, board.SDA)
 
 def find_attitude(dqw, dqx, dqy, dqz):
     norm = sqrt(dqw * dqw + dqx * dqx + dqy * dqy + dqz * dqz)
@@ -105,43 +152,103 @@ def find_attitude(dqw, dqx, dqy, dqz):
 
     return roll, pitch, yaw 
 
-def internet_on():
+def find_attitude_batch(quaternions):
+    """
+    Vectorized find_attitude (NumPy, for replay and post-processing): takes an
+    N x 4 array of quaternions (w, x, y, z columns, like the find_attitude
+    arguments) and returns roll, pitch and yaw arrays with the same sign
+    conventions and yaw wrapping (clockwise from 0 to 2*pi).
+    """
+    import numpy as np # optional dependency, loaded only when needed
+    q = np.asarray(quaternions, dtype = np.float64)
+    q = q / np.sqrt(np.einsum('ij,ij->i', q, q))[:, None]
+    dqw, dqx, dqy, dqz = q.T
+
+    ysqr = dqy * dqy
+
+    roll = -np.arctan2(2.0 * (dqw * dqx + dqy * dqz), 1.0 - 2.0 * (dqx * dqx + ysqr))
+    pitch = -np.arcsin(np.clip(2.0 * (dqw * dqy - dqz * dqx), -1.0, 1.0))
+    yaw_raw = np.arctan2(2.0 * (dqw * dqz + dqx * dqy), 1.0 - 2.0 * (ysqr + dqz * dqz))
+    yaw = np.where(yaw_raw > 0, 2*pi - yaw_raw, -yaw_raw)
+    return roll, pitch, yaw
+
+SK_HOST = 'localhost'
+SK_PORT = 3000
+SK_API = 'http://' + SK_HOST + ':' + str(SK_PORT) + '/signalk/v1/api/vessels/self/'
+SK_TIMEOUT = 5 # secs, Signal K server is local
+SK_STREAM_PATHS = ('navigation.position', 'navigation.magneticVariation')
+
+skSubscriber = None # skstream.skSubscription shared by the declination workers
+skStreamEnabled = True # 'skStream' option
+skSubscriberLock = threading.Lock()
+
+def startSkSubscription():
+    # position and magneticVariation pushed by the server, instead of polling its REST API
+    global skSubscriber
+    with skSubscriberLock:
+        if skStreamEnabled and skSubscriber is None:
+            import skstream
+            skSubscriber = skstream.skSubscription(SK_HOST, SK_PORT, SK_STREAM_PATHS).start()
+
+def skStreamed(path, source = None):
+    # last value pushed by the server, None when not subscribed, disconnected or not received yet
+    if skSubscriber is None or not skSubscriber.connected:
+        return None
+    return skSubscriber.get(path, source)
+
+def internet_on(session):
     try:
-        response = urlopen('https://www.google.com/', timeout=10)
+        response = session.head('https://www.google.com/', timeout=10)
         return True
     except: 
         return False
 
-def getSignalkVariation():
+def getSignalkVariation(dCfg, session):
+    import ujson
+    if dCfg.perf is not None: # only called when the declination could not be computed
+        dCfg.perf.declFailures += 1
+    variation = skStreamed('navigation.magneticVariation', dCfg.skSource)
+    if variation is not None :
+        return variation # the last value of the device, as pushed back by the server
     try:
         # use the last value stored in signalk
-        resp = requests.get('http://localhost:3000/signalk/v1/api/vessels/self/navigation/magneticVariation/$source', verify=False)
+        resp = session.get(SK_API + 'navigation/magneticVariation/$source', verify=False, timeout=SK_TIMEOUT)
         data = ujson.loads(resp.content)
-        if data != my_source :
+        if data != dCfg.skSource :
             try:
-                resp = requests.get('http://localhost:3000/signalk/v1/api/vessels/self/navigation/magneticVariation/values', verify=False)
+                resp = session.get(SK_API + 'navigation/magneticVariation/values', verify=False, timeout=SK_TIMEOUT)
                 data = ujson.loads(resp.content)
-                return data[my_source]['value']
+                return data[dCfg.skSource]['value']
             except:
-                return decl_rad # anyway return the last available value stored in 'decl_rad' global
+                return dCfg.decl_rad # anyway return the last available value of the device
         else:
-            resp = requests.get('http://localhost:3000/signalk/v1/api/vessels/self/navigation/magneticVariation/value', verify=False)
+            resp = session.get(SK_API + 'navigation/magneticVariation/value', verify=False, timeout=SK_TIMEOUT)
             data = ujson.loads(resp.content)
             return data
     except:
-        return decl_rad # anyway return the last available value stored in 'decl_rad' global
+        return dCfg.decl_rad # anyway return the last available value of the device
 
-def getDeclination():
+def getDeclination(dCfg, session):
+    import ujson
     try:
-        resp = requests.get('http://localhost:3000/signalk/v1/api/vessels/self/navigation/position/value', verify=False)
-        data = ujson.loads(resp.content)
+        data = skStreamed('navigation.position')
+        if data is None : # no live subscription: REST API
+            resp = session.get(SK_API + 'navigation/position/value', verify=False, timeout=SK_TIMEOUT)
+            data = ujson.loads(resp.content)
         #TODO Manage eception 'position' not available in Signalk data
+        if dCfg.decl_model :
+            try:
+                import wmm
+                return wmm.declination(data['latitude'], data['longitude']) # offline World Magnetic Model
+            except (OSError, ValueError) as e:
+                logger.error("World Magnetic Model unavailable: " + repr(e))
+                dCfg.decl_model = False # use NOAA from now on
         lat = "{:.4f}".format(data['latitude'])
         lon = "{:.4f}".format(data['longitude'])
-        if internet_on() :
+        if internet_on(session) :
             NOAA_DeclCalcAPI = "https://www.ngdc.noaa.gov/geomag-web/calculators/calculateDeclination?lat1="\
 +lat+"&lon1="+lon+"&key=zNEw7&resultFormat=json"
-            resp = requests.get(NOAA_DeclCalcAPI, verify=True)
+            resp = session.get(NOAA_DeclCalcAPI, verify=True, timeout=10)
             try:
                 # manage malformed/unexpected resp content
                 data = ujson.loads(resp.content)
@@ -150,17 +257,339 @@ def getDeclination():
                     #logger.info("Declination got from NoAA")
                     return key['declination'] * pi/180 # NoAA conventionally responds in degrees
             except:
-                ret = getSignalkVariation()
+                ret = getSignalkVariation(dCfg, session)
                 return ret # anyway return last available value
         else:
-            ret = getSignalkVariation()
+            ret = getSignalkVariation(dCfg, session)
             return ret # anyway return last available value 
     except:
-        ret = getSignalkVariation()
+        ret = getSignalkVariation(dCfg, session)
         return ret # anyway return last available value 
 
+def declinationWorker(dCfg):
+    """
+    Background refresh of the declination of a device, on a reused HTTP session.
+    The report loop only reads 'dCfg.decl_rad' (the last good value, replaced
+    atomically) so it never waits for the network.
+    With the World Magnetic Model the declination follows the position every
+    few seconds, otherwise NOAA is queried every 'devDeclInterval' hours.
+    The worker idles while the declination is not required, and is woken up
+    by a change of the declination options ('dCfg.decl_wakeup').
+    """
+    session = None
+    published = False
+    while True:
+        if not dCfg.decl_needed :
+            published = False
+            dCfg.decl_wakeup.wait()
+            dCfg.decl_wakeup.clear()
+            continue
+        if session is None : # network modules loaded only when the declination is required
+            import requests
+            startSkSubscription()
+            session = requests.Session()
+        start = time.monotonic()
+        decl_rad = getDeclination(dCfg, session)
+        if dCfg.perf is not None :
+            dCfg.perf.declFetchTime = time.monotonic() - start
+        if decl_rad != dCfg.decl_rad or not published :
+            dCfg.decl_rad = decl_rad
+            dCfg.decl_updated = True # magneticVariation is sent with the next delta
+            published = True
+        if dCfg.decl_model :
+            dCfg.decl_wakeup.wait(dCfg.decl_model_interval) # Interval in seconds
+        else :
+            dCfg.decl_wakeup.wait(dCfg.decl_interval*3600) # Interval in hours
+        dCfg.decl_wakeup.clear()
+
+def fitDeviationCoefficients(points):
+    """
+    Least squares fit of the classic A-E deviation coefficients (degrees)
+        dev = A + B sin(h) + C cos(h) + D sin(2h) + E cos(2h)
+    to the (compass heading, deviation) points of a compass swing.
+    """
+    if len(set(h for h, d in points)) < 5:
+        raise ValueError("at least 5 headings are needed to fit the A-E coefficients")
+    ata = [[0.0] * 6 for i in range(5)] # normal equations, augmented matrix
+    for h, d in points:
+        r = h * pi/180
+        f = (1.0, sin(r), cos(r), sin(2*r), cos(2*r))
+        for i in range(5):
+            for j in range(5):
+                ata[i][j] += f[i] * f[j]
+            ata[i][5] += f[i] * d
+    for i in range(5): # Gauss-Jordan elimination with partial pivoting
+        p = max(range(i, 5), key = lambda k: abs(ata[k][i]))
+        ata[i], ata[p] = ata[p], ata[i]
+        if abs(ata[i][i]) < 1e-12:
+            raise ValueError("compass swing headings do not allow an A-E fit")
+        for k in range(5):
+            if k != i:
+                f = ata[k][i] / ata[i][i]
+                for j in range(i, 6):
+                    ata[k][j] -= f * ata[i][j]
+    return tuple(ata[i][5] / ata[i][i] for i in range(5))
+
+class deviationTable():
+    """
+    Deviation curve over the compass heading, precomputed in STEPS points
+    (0.1 degree) so that the correction of a sample is an index plus a lerp.
+    The curve interpolates linearly the points of the compass swing or, when
+    'fit' is requested, follows their A-E coefficients fit.
+    """
+    STEPS = 3600
+
+    def __init__(self, swing, fit = False):
+        points = sorted((h % 360.0, d) for h, d in swing)
+        self.coefficients = None
+        if fit:
+            a, b, c, d, e = self.coefficients = fitDeviationCoefficients(points)
+            def curve(h):
+                r = h * pi/180
+                return a + b*sin(r) + c*cos(r) + d*sin(2*r) + e*cos(2*r)
+        else:
+            headings = [h for h, d in points]
+            def curve(h):
+                k = bisect_right(headings, h)
+                h0, d0 = points[k-1] if k > 0 else (points[-1][0] - 360.0, points[-1][1])
+                h1, d1 = points[k] if k < len(points) else (points[0][0] + 360.0, points[0][1])
+                return d0 if h1 == h0 else d0 + (h - h0) * (d1 - d0) / (h1 - h0)
+        self.table = array('d', (curve(i * 360.0/self.STEPS) * pi/180 for i in range(self.STEPS)))
+        self.table.extend(self.table[:2]) # wrap around 360 degrees
+        self.scale = self.STEPS / (2*pi)
+
+    def __call__(self, heading):
+        """ deviation (radians) at the compass heading (radians) """
+        x = (heading * self.scale) % self.STEPS
+        i = int(x)
+        t = self.table
+        return t[i] + (x - i) * (t[i+1] - t[i])
+
+    @classmethod
+    def fromOptions(cls, options):
+        """ the device deviation table, None if no compass swing is configured """
+        swing = [(p["heading"], p["deviation"]) for p in options.get("devDeviationTable", [])]
+        if not swing:
+            return None
+        fit = options.get("devDeviationFit", False)
+        if fit:
+            try:
+                table = cls(swing, fit)
+                logger.info("deviation A-E coefficients: " + ", ".join("{:.3f}".format(c) for c in table.coefficients))
+                return table
+            except ValueError as e:
+                logger.error(str(e) + ": deviation table interpolated")
+        return cls(swing)
+
+TICK_STATS_INTERVAL = 600 # secs between the logs of the scheduler statistics
+
+class tickScheduler():
+    """
+    Monotonic deadline scheduler: tick n is due at start + n*period, so the time
+    spent reading, converting and publishing does not add up to the period.
+    When the deadlines of one or more ticks have already passed, policy 'drop'
+    skips them and realigns on the next deadline, policy 'catchup' runs them
+    back to back (at most 'maxCatchup', the excess is dropped anyway).
+    """
+    def __init__(self, period, policy = 'drop', maxCatchup = 3):
+        self.period = period
+        self.policy = policy
+        self.maxCatchup = maxCatchup
+        self.deadline = None # first tick at once, at the first wait
+        self.last = None
+        # statistics
+        self.ticks = 0
+        self.overruns = 0 # ticks started after their deadline
+        self.dropped = 0  # ticks skipped
+        self.jitterSum = 0.0 # abs(actual period - period)
+        self.jitterMax = 0.0
+
+    def wait(self):
+        now = time.monotonic()
+        if self.deadline is None: # first tick: on time by definition
+            self.deadline = now
+        elif now < self.deadline:
+            time.sleep(self.deadline - now)
+            now = time.monotonic()
+        else:
+            self.overruns += 1
+        missed = int((now - self.deadline) / self.period) # deadlines passed after the one of this tick
+        if missed > 0 and self.policy == 'catchup':
+            skip = max(0, missed - self.maxCatchup)
+        else:
+            skip = missed
+        self.dropped += skip
+        self.deadline += (skip + 1) * self.period
+        if self.last is not None:
+            jitter = abs(now - self.last - self.period)
+            self.jitterSum += jitter
+            if jitter > self.jitterMax:
+                self.jitterMax = jitter
+        self.last = now
+        self.ticks += 1
+        return now
+
+    def stats(self):
+        return {'ticks': self.ticks, 'overruns': self.overruns, 'dropped': self.dropped,
+                'jitterMean': self.jitterSum / max(1, self.ticks - 1), 'jitterMax': self.jitterMax}
+
+def imuPath(source):
+    # Signal K path of the plugin own values of a device, e.g. sensors.imu.I2C_at0x4b
+    return 'sensors.imu.' + ''.join(c for c in source if c.isalnum() or c == '_')
+
+RING_SLOTS = 64 # raw samples buffered between the acquisition and the output of a device
+# slot of the ring: t, flags, quaternion i j k real, gyro xyz, acceleration xyz, magnetic xyz,
+# calibration status, read time
+SLOT_SIZE = 17
+S_ATTITUDE, S_GYRO, S_ACCEL, S_RAW, S_CALIB = 1, 2, 4, 8, 16 # flags
+
+class sampleRing():
+    """
+    Preallocated ring of raw samples between the acquisition thread of a
+    device (sensor reads only) and its consumer thread (attitude, corrections,
+    deltas output): one writer, one reader, each owning its own counter. The
+    writer never waits: when the consumer lags (slow stdout, GC pause) and
+    the ring is full the new sample is dropped and counted in 'overflows',
+    so the sensor is read on time whatever happens downstream.
+    """
+    def __init__(self, slots = RING_SLOTS):
+        self.slots = slots
+        self.data = array('d', bytes(8 * SLOT_SIZE * slots))
+        self.head = 0 # samples written (acquisition only)
+        self.tail = 0 # samples read (consumer only)
+        self.overflows = 0
+        self.errors = 0 # samples the consumer failed to convert or send
+        self.maxBacklog = 0
+        self.ready = threading.Event()
+
+    def slot(self):
+        """ offset in 'data' of the slot to be written, None when the ring is full """
+        backlog = self.head - self.tail
+        if backlog > self.maxBacklog:
+            self.maxBacklog = backlog
+        if backlog >= self.slots:
+            self.overflows += 1
+            return None
+        return (self.head % self.slots) * SLOT_SIZE
+
+    def commit(self):
+        self.head += 1
+        self.ready.set()
+
+    def stats(self):
+        return {'ringOverflows': self.overflows, 'ringMaxBacklog': self.maxBacklog, 'sampleErrors': self.errors}
+
+PERF_WINDOW = 1024 # samples kept for the percentiles of the performance telemetry
+
+class perfMonitor():
+    """
+    Performance telemetry of a device: the report loop records the I2C read
+    time and the latency (tick wakeup to delta written) of every sample in
+    preallocated ring arrays, percentiles and rates are computed only when
+    the values are published (every 'interval' secs) or dumped (SIGUSR1).
+    """
+    def __init__(self, source, interval, window = PERF_WINDOW):
+        self.interval = interval
+        self.path = imuPath(source) + '.performance.'
+        self.window = window
+        self.readTimes = array('d', bytes(8 * window))
+        self.latencies = array('d', bytes(8 * window))
+        self.count = 0
+        self.lastSample = None # monotonic time of the last good sample
+        self.ring = None # sampleRing of the device
+        self.faults = 0 # read faults recovered by deviceSupervisor
+        self.declFetchTime = None
+        self.declFailures = 0
+        self.lastCount = 0
+        self.lastTime = time.monotonic()
+
+    def sample(self, readTime, latency, now):
+        i = self.count % self.window
+        self.readTimes[i] = readTime
+        self.latencies[i] = latency
+        self.count += 1
+        self.lastSample = now
+
+    @staticmethod
+    def percentile(ordered, p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else None
+
+    def values(self, now):
+        n = min(self.count, self.window)
+        latencies = sorted(self.latencies[:n])
+        readTimes = self.readTimes[:n]
+        rate = (self.count - self.lastCount) / max(1e-6, now - self.lastTime)
+        self.lastCount, self.lastTime = self.count, now
+        path = self.path
+        return [{'path': path + 'sampleRate', 'value': rate},
+                {'path': path + 'latency.p50', 'value': self.percentile(latencies, 0.50)},
+                {'path': path + 'latency.p95', 'value': self.percentile(latencies, 0.95)},
+                {'path': path + 'latency.p99', 'value': self.percentile(latencies, 0.99)},
+                {'path': path + 'i2cReadTime.mean', 'value': sum(readTimes) / n if n else None},
+                {'path': path + 'i2cReadTime.max', 'value': max(readTimes) if n else None},
+                {'path': path + 'faults', 'value': self.faults},
+                {'path': path + 'ringOverflows', 'value': self.ring.overflows if self.ring is not None else None},
+                {'path': path + 'sampleErrors', 'value': self.ring.errors if self.ring is not None else None},
+                {'path': path + 'declination.fetchTime', 'value': self.declFetchTime},
+                {'path': path + 'declination.failures', 'value': self.declFailures},
+                {'path': path + 'timeSinceLastSample', 'value': None if self.lastSample is None else now - self.lastSample}]
+
+PROCESS_PERF_PATH = 'sensors.imu.performance.' # telemetry of the whole process, not of a device
+
+def processPerfValues():
+    # the adafruit library prints to a single sink: its packet errors cannot be told apart per device
+    return [{'path': PROCESS_PERF_PATH + 'packetErrors', 'value': ringLog.packetErrors}]
+
+def angleDiff(a, b):
+    d = abs(a - b) % (2*pi)
+    return 2*pi - d if d > pi else d
+
+class emissionPolicy():
+    """
+    Chooses the paths of a sample to be sent. A path with a deadband (radians)
+    is sent when it changed more than its deadband since the last value sent,
+    or when it has been silent for 'heartbeat' secs. As soon as a path moves
+    beyond its deadband all of them are also sent at every sample for 'hold' secs,
+    so that in a seaway the output runs at the full rate while at anchor it
+    drops to the heartbeat. Paths without deadband are always sent.
+    """
+    def __init__(self, deadbands, heartbeat, hold):
+        self.deadbands = deadbands
+        self.heartbeat = heartbeat
+        self.hold = hold
+        self.last = {} # path -> (value, time) last sent
+        self.activeUntil = 0.0
+
+    @staticmethod
+    def change(value, sent):
+        if isinstance(value, dict): # attitude
+            return max(angleDiff(value[k], sent[k]) for k in value)
+        return angleDiff(value, sent)
+
+    def filter(self, values, now):
+        deadbands = self.deadbands
+        last = self.last
+        due = [] # per value: no deadband, never sent or moved beyond its deadband
+        for v in values:
+            deadband = deadbands.get(v['path'])
+            if deadband is None:
+                due.append(True)
+                continue
+            sent = last.get(v['path'])
+            moved = sent is None or self.change(v['value'], sent[0]) > deadband
+            if moved:
+                self.activeUntil = now + self.hold
+            due.append(moved)
+        active = now < self.activeUntil
+        selected = [v for v, d in zip(values, due)
+                    if d or active or now - last[v['path']][1] >= self.heartbeat]
+        for v in selected:
+            if v['path'] in deadbands:
+                last[v['path']] = (v['value'], now)
+        return selected
+
 class pluginConfig():
-    def __init__(self, dev, rate, rd, nc, nd, di, de, ohdg, odev, oroll, opitch):
+    def __init__(self, dev, rate, rd, nc, nd, di, de, ohdg, odev, oroll, opitch, dm = True, dmi = 10, tp = 'drop'):
         self.name = dev
         self.rate = rate
         self.delay = rd
@@ -172,7 +601,32 @@ class pluginConfig():
         self.decl_needed = nd
         self.decl_interval = di
         self.decl_estimate = de
-        self.delaycount = 0
+        self.decl_model = dm
+        self.decl_model_interval = dmi
+        self.tick_policy = tp
+        self.scheduler = None # tickScheduler of the report loop
+        # per-device runtime state (set when the device is found on the bus)
+        self.addr = None
+        self.source = None   # 'src' of the deltas, e.g. I2C_at[0x4b]
+        self.skSource = None # '$source' as seen by Signal K, e.g. sk-py-bno08x.I2C_at[0x4b]
+        self.imu_path = None # path of the device own values, e.g. sensors.imu.I2C_at0x4b
+        self.decl_rad = de * pi/180 # choosen to use degrees for user input in config
+        self.decl_updated = False
+        self.decl_wakeup = threading.Event() # declination options changed
+        self.backend = 'i2c' # 'devBackend': i2c, sim or replay
+        self.pending = queue.SimpleQueue() # options received by the control channel, applied by the consumer
+        self.reschedule = False # rates changed: reports and tick to be changed by the acquisition
+        self.ring = None # sampleRing between acquisition and output
+        self.deviation = None # deviationTable (replaced as a whole on reload)
+        self.recorder = None # sensorRecorder of the raw samples, if requested
+        self.int_pin = None # INT line of the sensor, if wired
+        self.calibration = None # calibrationTracker, when the calibration is required
+        self.last_read = None # monotonic time of the last good read of the sensor
+        self.stale = False # 'stale' status sent: 'ok' is sent at the next good read
+        self.emission = None # emissionPolicy, None means every path at every sample
+        self.perf = None # perfMonitor, None when the telemetry is disabled
+        self.rot_rate = 0 # navigation.rateOfTurn deltas/sec, 0 disabled
+        self.accel_rate = 0 # acceleration deltas/sec, 0 disabled
 
 class CustomAdapter(logging.LoggerAdapter):
     """
@@ -183,134 +637,645 @@ class CustomAdapter(logging.LoggerAdapter):
     def process(self, msg, kwargs):
         return '[%s] %s' % (self.extra['pluginid'], msg), kwargs
 
-def skOutput(mySource, path, value):
+class ringLog():
+    """
+    File-like sink for the diagnostic chatter printed by the adafruit library.
+    Writes only append to an in-memory ring buffer (no file I/O on the caller
+    path, oldest lines dropped when full); a background writer appends them to
+    'path' in batches, rotating the file to 'path.1' when it exceeds maxBytes.
+    Packets the (patched) library prints instead of raising are counted.
+    """
+    PACKET_ERROR_MARK = '** Packet **' # header of a printed adafruit_bno08x Packet
+    packetErrors = 0
+    def __init__(self, path, maxBytes = 1000000, size = 4096, interval = 5.0):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.interval = interval
+        self.buffer = collections.deque(maxlen = size)
+        self.lock = threading.Lock() # serializes the writers to the file, not the callers
 
-    skData = {'updates': [{'source': {'label': 'IMU sensor', 'src': mySource }, 'timestamp': datetime.datetime.utcnow().isoformat() + "Z", 'values': [{'path': path, 'value': value}]}]}
-    print(json.dumps(skData) + '\n')
+    def write(self, text):
+        self.buffer.append(text)
+        if self.PACKET_ERROR_MARK in text:
+            ringLog.packetErrors += 1
+        return len(text)
 
-def skOutput_att(mySource, path, r, p, y):
+    def flush(self):
+        pass # batched by the writer thread
 
-    skData = {'updates': [{'source': {'label': 'IMU sensor', 'src': mySource }, 'timestamp': datetime.datetime.utcnow().isoformat() + "Z", 'values': [{'path': path, 'value':\
-            {"pitch": p, "roll": r, "yaw": y}}]}]}
-    print(json.dumps(skData) + '\n')
+    def drain(self):
+        chunks = []
+        try:
+            while True:
+                chunks.append(self.buffer.popleft())
+        except IndexError:
+            pass
+        if not chunks:
+            return
+        data = ''.join(chunks)
+        with self.lock:
+            try:
+                if os.path.getsize(self.path) + len(data) > self.maxBytes:
+                    os.replace(self.path, self.path + '.1')
+            except OSError: # not yet created
+                pass
+            with open(self.path, 'a') as f:
+                f.write(data)
 
-def sensorReportLoop(mySource,rate, bno, dCfg):
-    times_for_calib_status_update = 100 # calibration status sent every 100 times the normal attitude delta is sent
-    declInterval_start = time.monotonic()
-    global decl_rad
+    def writer(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.drain()
+            except OSError as e:
+                logger.error("cannot write " + self.path + ": " + repr(e))
+
+    def start(self):
+        threading.Thread(target=self.writer, name=self.path, daemon=True).start()
+        atexit.register(self.drain)
+        return self
+
+class skDeltaTemplate():
+    """
+    Pre-built serializer for the Signal K deltas of one source: the constant
+    'source' part of the update is encoded once, so that only the timestamp
+    and the 'values' array are encoded for each sample.
+    """
+    def __init__(self, mySource, label = 'IMU sensor'):
+        self.head = '{"updates": [{"source": ' + json.dumps({'label': label, 'src': mySource}) + ', "timestamp": "'
+        self.sep = 'Z", "values": '
+        self.tail = '}]}'
+
+    def dumps(self, values, timestamp = None):
+        if timestamp is None:
+            timestamp = datetime.datetime.utcnow().isoformat()
+        return self.head + timestamp + self.sep + json.dumps(values) + self.tail
+
+skTemplates = {}
+
+def skTemplate(mySource):
+    template = skTemplates.get(mySource)
+    if template is None:
+        template = skTemplates[mySource] = skDeltaTemplate(mySource)
+    return template
+
+skOutputLock = threading.Lock()
+skStream = sys.__stdout__ # the real stdout: sys.stdout is the debug.log ring buffer
+outputClosed = threading.Event() # the server closed the pipe of the deltas: the process exits
+
+class skFrameWriter():
+    """
+    Batched output of the deltas (one per line, as usual): up to 'size' deltas
+    are joined in a single frame, written with one write and one flush. A
+    frame not yet full is flushed by a background thread at most 'interval'
+    secs after its first delta, so batching bounds the latency added.
+    """
+    def __init__(self, stream, size, interval):
+        self.stream = stream
+        self.size = size
+        self.interval = interval
+        self.pending = []
+        self.first = None # time of the oldest pending delta
+        self.lock = threading.Lock()
+
+    def write(self, line):
+        with self.lock:
+            if not self.pending:
+                self.first = time.monotonic()
+            self.pending.append(line)
+            if len(self.pending) >= self.size:
+                self._flush()
+
+    def _flush(self):
+        if self.pending:
+            frame = ''.join(self.pending)
+            self.pending = []
+            try:
+                self.stream.write(frame)
+                self.stream.flush()
+            except BrokenPipeError:
+                outputClosed.set()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def writer(self):
+        while True:
+            with self.lock:
+                wait = self.interval if not self.pending else self.first + self.interval - time.monotonic()
+                if wait <= 0:
+                    self._flush()
+                    wait = self.interval
+            time.sleep(wait)
+
+    def start(self):
+        threading.Thread(target=self.writer, name='deltas', daemon=True).start()
+        atexit.register(self.flush)
+        return self
+
+skFrame = None # skFrameWriter when the batched output is configured
+
+def skOutputDelta(template, values):
+    # one delta (one timestamp) carrying all the 'values' of a sample, one line per delta
+    line = template.dumps(values) + '\n'
+    if skFrame is not None:
+        skFrame.write(line)
+        return
+    try:
+        with skOutputLock:
+            skStream.write(line)
+            skStream.flush()
+    except BrokenPipeError:
+        outputClosed.set()
+
+MAG_REPORT_INTERVAL = 1.0 # secs, magnetometer reports only feed the calibration status
+CALIB_VALIDATE = 3.0 # secs given to the calibration stored in the sensor to report a good status
+CALIB_STABLE = 5.0 # secs the status must stay good before a refined calibration is saved
+CALIB_WARN = 50.0 # secs of refinement before a 'not calibrated yet' warning
+
+class calibrationTracker():
+    """
+    Non-blocking calibration, stepped by the report loop while attitude and
+    headings are published. The BNO08x restores its saved calibration at
+    reset: if the status reaches 2 (good for navigation) within CALIB_VALIDATE
+    secs it is kept, otherwise the dynamic calibration is started and saved
+    to the sensor once the status has stayed good for CALIB_STABLE secs.
+    The status is read once per magnetometer report and tracked all along.
+    """
+    def __init__(self, source):
+        self.source = source
+        self.state = 'validating' # then 'refining' and/or 'good'
+        self.status = None
+        self.start = None
+        self.goodSince = None
+        self.nextCheck = 0.0
+        self.warned = False
+
+    def log(self, message):
+        # calibration.log keeps the calibration history (library packet errors go to debug.log)
+        with open('calibration.log', 'a') as calibLog:
+            print(datetime.datetime.utcnow().isoformat() + ' ' + self.source + ' ' + message, file=calibLog)
+
+    def step(self, bno, busLock, now):
+        """ True when the status changed (to be sent) """
+        if now < self.nextCheck:
+            return False
+        self.nextCheck = now + MAG_REPORT_INTERVAL
+        if self.start is None:
+            self.start = now
+            self.log('calibration restored from the sensor, validating')
+        with busLock :
+            status = bno.calibration_status
+        changed = status != self.status
+        self.status = status
+        if status < 2:
+            self.goodSince = None
+        elif self.goodSince is None:
+            self.goodSince = now
+        if self.state == 'validating':
+            if self.goodSince is not None:
+                self.state = 'good'
+                self.log('stored calibration valid in ' + "{:.1f}".format(now - self.start) + ' s: ' + REPORT_ACCURACY_STATUS[status])
+            elif now - self.start > CALIB_VALIDATE:
+                with busLock :
+                    bno.begin_calibration()
+                self.state = 'refining'
+                self.start = now
+                self.log('stored calibration not valid (' + REPORT_ACCURACY_STATUS[status] + '): calibrating in background')
+        elif self.state == 'refining':
+            if self.goodSince is not None and now - self.goodSince >= CALIB_STABLE:
+                with busLock :
+                    bno.save_calibration_data()
+                self.state = 'good'
+                self.log('calibration obtained in ' + "{:.1f}".format(now - self.start) + ' s and saved: ' + REPORT_ACCURACY_STATUS[status])
+                logger.info(self.source + " calibration done")
+            elif not self.warned and now - self.start > CALIB_WARN:
+                self.warned = True
+                logger.warning(self.source + " not calibrated yet: move the sensor through all the orientations")
+        return changed
+
+    def values(self):
+        if self.status is None : # not read yet
+            return []
+        return [{'path': 'sensors.magnetometer.calibration_status', 'value': self.status},
+                {'path': 'sensors.magnetometer.calibration_quality', 'value': REPORT_ACCURACY_STATUS[self.status]}]
+INT_POLL = 0.0005 # secs between two reads of the INT line
+
+def outputTicks(dCfg):
+    """
+    Multi-rate output: the report loop ticks at the fastest rate of the path
+    groups, each group is sent every 'ticks[group]' ticks (0 when disabled).
+    Returns the tick period (secs) and ticks.
+    """
+    rates = {'attitude': dCfg.rate, 'rateOfTurn': dCfg.rot_rate, 'acceleration': dCfg.accel_rate}
+    base = max(rates.values())
+    # reports/sec converted in secs btw reports, 'devDelayReports' ticks skipped every report
+    period = (dCfg.delay + 1)/base
+    return period, {group: max(1, round(base / rate)) if rate > 0 else 0 for group, rate in rates.items()}
+
+POLL_MARGIN = 0.5 # report interval / read period of a polled sensor
+
+def reportInterval(dCfg, period):
+    # without the INT line the reads are not synchronized with the sensor clock,
+    # which reports twice per read period so that every read finds a new report
+    return period * (1.0 if dCfg.int_pin is not None else POLL_MARGIN)
+
+def enableReports(bno, dCfg):
+    # the sensor sends the reports at the rate they are published (or recorded):
+    # no backlog of unused reports to be read and parsed at every poll
+    tick, ticks = outputTicks(dCfg)
+    period = reportInterval(dCfg, tick * ticks['attitude'])
+    bno.enable_feature(BNO_REPORT_GAME_ROTATION_VECTOR, int(period * 1e6))
+    magPeriod = period if dCfg.recorder is not None else max(period, MAG_REPORT_INTERVAL)
+    bno.enable_feature(BNO_REPORT_MAGNETOMETER, int(magPeriod * 1e6))
+    if ticks['rateOfTurn'] :
+        bno.enable_feature(BNO_REPORT_GYROSCOPE, int(reportInterval(dCfg, tick * ticks['rateOfTurn']) * 1e6))
+    if ticks['acceleration'] :
+        bno.enable_feature(BNO_REPORT_ACCELEROMETER, int(reportInterval(dCfg, tick * ticks['acceleration']) * 1e6))
+
+def openIntPin(name):
+    """ the BNO08x INT line (e.g. 'D24') as a digital input, low while a report is waiting """
+    from digitalio import DigitalInOut, Direction, Pull
+    pin = DigitalInOut(getattr(board, name))
+    pin.direction = Direction.INPUT
+    pin.pull = Pull.UP
+    return pin
+
+def waitReport(pin, timeout):
+    # polls the INT line (no I2C traffic) until a report is waiting or timeout expires
+    end = time.monotonic() + timeout
+    while pin.value:
+        if time.monotonic() >= end:
+            return False
+        time.sleep(INT_POLL)
+    return True
+
+def readSample(bno, busLock):
+    with busLock : # the I2C bus is shared by all the devices
+        return bno.game_quaternion
+
+def readSensors(bno, busLock, attitude, gyro, acceleration, raw):
+    """
+    One bus transaction for the reports due at this tick: game quaternion,
+    gyro and acceleration (None when not due), plus magnetometer and
+    calibration status of the raw sample when recording.
+    """
+    with busLock : # the I2C bus is shared by all the devices
+        return (bno.game_quaternion if attitude else None,
+                bno.gyro if gyro else None,
+                bno.acceleration if acceleration else None,
+                bno.magnetic if raw else None,
+                bno.calibration_status if raw else None)
+
+def waitFirstReport(bno, busLock, timeout = 1.0):
+    # no fixed pause after enableReports: each device waits for its own first report
+    end = time.monotonic() + timeout
     while True:
-        time.sleep(rate)
-        if dCfg.delaycount == 0:
-            dCfg.delaycount = dCfg.delay
-            with open ('debug.log', 'a') as sys.stdout :
-                game_quat_i, game_quat_j, game_quat_k, game_quat_real = bno.game_quaternion
-                sys.stdout.flush()
-            sys.stdout = sys.__stdout__ # restore normal stdout file object
-            roll, pitch, yaw = find_attitude(game_quat_real, game_quat_i, game_quat_j, game_quat_k)
-            roll += dCfg.rollOffset * pi/180
-            pitch += dCfg.pitchOffset * pi/180
-            yaw += dCfg.hdgOffset * pi/180
-            skOutput_att(mySource,'navigation.attitude', roll, pitch, yaw)
-            skOutput(mySource,'navigation.headingCompass', yaw) # headingCompass from 0 to 2*pi radians clockwise
-            headingMagnetic = yaw + dCfg.hdgDeviation * pi/180
-            #TODO 1: implement a 'deviation table' of values for different bearings and interpolate between them
-            skOutput(mySource,'navigation.headingMagnetic', headingMagnetic)
-            if dCfg.decl_needed :
-                skOutput ( mySource, 'navigation.headingTrue', headingMagnetic + decl_rad )
-                time_current = time.monotonic()
-                if ((time_current - declInterval_start) >= dCfg.decl_interval*3600) : # Interval in hours
-                    decl_rad = getDeclination()
-                    declInterval_start = time_current
-                    skOutput ( mySource, 'navigation.magneticVariation', decl_rad )
-            if dCfg.calib_needed :
-                if times_for_calib_status_update == 0:
-                    times_for_calib_status_update = 100
-                    if os.stat('debug.log').st_size > 1000000 : # save only last (of less than 1mb size) debug.log
-                        mode = 'w'
-                    else:
-                        mode = 'a'
-                    with open('debug.log', mode) as sys.stdout : # redirect stdout to debug.log to avoid debug messages 
-                                                                 # being read by javascript parent process
-                        print ("DEBUG: PERIODIC CALIBRATION AT "+ datetime.datetime.utcnow().isoformat())
-                        calibration_status = bno.calibration_status
-                        sys.stdout.flush()
-                    sys.stdout = sys.__stdout__ # restore normal stdout file object
-                    skOutput(mySource,'sensors.magnetometer.calibration_status', calibration_status)
-                    skOutput(mySource,'sensors.magnetometer.calibration_quality', adafruit_bno08x.REPORT_ACCURACY_STATUS[calibration_status])
-                else:
-                    times_for_calib_status_update -=1
-            sys.stdout.flush()
-        else:
-            dCfg.delaycount -= 1
-
-def sensorCalibrate(dev, mySource,  bno):
-    with open ('calibration.log', 'w') as sys.stdout: # log all packet error during calibration 
-        bno.begin_calibration()
-        bno.enable_feature(BNO_REPORT_MAGNETOMETER)
-        bno.enable_feature(BNO_REPORT_GAME_ROTATION_VECTOR)
-        calibration_good = False
-        calibration_good_at = None
-        start_time = time.monotonic()
-        source ='BNO08X_I2C_AT[' +hex(dev)+']'
-        print ("=============== "+ source + " CALIBRATION START =========================")
-        print ("")
+        try:
+            quaternion = readSample(bno, busLock)
+            if any(quaternion) :
+                return quaternion
+            # adafruit_bno08x: placeholder reading set when the sensor acknowledges the enable
+            if time.monotonic() >= end:
+                raise RuntimeError("no rotation vector report from the sensor")
+        except RuntimeError: # adafruit_bno08x: no report received yet
+            if time.monotonic() >= end:
+                raise
+        time.sleep(0.01)
+
+def applyCorrections(dCfg, roll, pitch, yaw):
+    """
+    Installation offsets and deviation: returns roll, pitch, headingCompass
+    (the corrected yaw) and headingMagnetic, all in radians.
+    """
+    roll += dCfg.rollOffset * pi/180
+    pitch += dCfg.pitchOffset * pi/180
+    yaw += dCfg.hdgOffset * pi/180
+    deviation = dCfg.deviation
+    if deviation is None :
+        headingMagnetic = yaw + dCfg.hdgDeviation * pi/180
+    else :
+        headingMagnetic = yaw + deviation(yaw) # interpolated by bearing from the compass swing
+    return roll, pitch, yaw, headingMagnetic
+
+def attitudeValues(dCfg, roll, pitch, yaw, headingMagnetic):
+    values = [{'path': 'navigation.attitude', 'value': {"pitch": pitch, "roll": roll, "yaw": yaw}},
+              {'path': 'navigation.headingCompass', 'value': yaw}, # headingCompass from 0 to 2*pi radians clockwise
+              {'path': 'navigation.headingMagnetic', 'value': headingMagnetic}]
+    if dCfg.decl_needed :
+        decl_updated = dCfg.decl_updated
+        if decl_updated :
+            dCfg.decl_updated = False
+        decl_rad = dCfg.decl_rad # last good value from declinationWorker
+        values.append({'path': 'navigation.headingTrue', 'value': headingMagnetic + decl_rad})
+        if decl_updated :
+            values.append({'path': 'navigation.magneticVariation', 'value': decl_rad})
+    return values
+
+def motionValues(dCfg, gyro, acceleration):
+    values = []
+    if gyro is not None :
+        # z axis up, counterclockwise: rateOfTurn is positive turning to starboard
+        values.append({'path': 'navigation.rateOfTurn', 'value': -gyro[2]})
+    if acceleration is not None :
+        x, y, z = acceleration
+        values.append({'path': dCfg.imu_path + '.acceleration', 'value': {"x": x, "y": y, "z": z}})
+    return values
+
+def sensorReportLoop(bno, dCfg, busLock):
+    """
+    Acquisition of a device: at every tick reads the sensors due and stores
+    the raw sample in the ring of the device. Conversion and output run in
+    sampleConsumer, so a slow stdout never delays the reads.
+    """
+    ring = dCfg.ring
+    if ring is None : # first run (the supervisor restarts the acquisition on the same ring)
+        ring = dCfg.ring = sampleRing()
+        if dCfg.perf is not None :
+            dCfg.perf.ring = ring
+        threading.Thread(target=sampleConsumer, args=(dCfg, ring), name=dCfg.source + '.output', daemon=True).start()
+    data = ring.data
+    timed = dCfg.perf is not None
+    readTime = 0.0
+    period, ticks = outputTicks(dCfg)
+    # the first report comes one report interval after enableReports, however slow the rate
+    waitFirstReport(bno, busLock, max(1.0, 2 * reportInterval(dCfg, period * ticks['attitude'])))
+    # the ticks start from the first report: the wait for it is not counted as an overrun
+    attTicks, rotTicks, accelTicks = ticks['attitude'], ticks['rateOfTurn'], ticks['acceleration']
+    scheduler = dCfg.scheduler = tickScheduler(period, dCfg.tick_policy)
+    stats_ticks = max(1, int(TICK_STATS_INTERVAL / scheduler.period))
+    tick = -1
+    while True:
+        now = scheduler.wait()
+        if dCfg.reschedule :
+            # new rates from the control channel: the tick restarts on the new period
+            dCfg.reschedule = False
+            with busLock :
+                enableReports(bno, dCfg)
+            period, ticks = outputTicks(dCfg)
+            attTicks, rotTicks, accelTicks = ticks['attitude'], ticks['rateOfTurn'], ticks['acceleration']
+            scheduler = dCfg.scheduler = tickScheduler(period, dCfg.tick_policy)
+            stats_ticks = max(1, int(TICK_STATS_INTERVAL / scheduler.period))
+            tick = -1
+            continue
+        if dCfg.int_pin is not None and not waitReport(dCfg.int_pin, scheduler.period/2) :
+            continue # no new report from the sensor: the bus is not touched
+        tick += 1
+        # the groups due at this tick: each sensor is read at the rate of its group only
+        attitude = tick % attTicks == 0
+        rot = rotTicks and tick % rotTicks == 0
+        accel = accelTicks and tick % accelTicks == 0
+        raw = attitude and dCfg.recorder is not None
+        if timed :
+            readStart = time.monotonic()
+        quaternion, gyro, acceleration, magnetic, calibration_status = readSensors(bno, busLock, attitude, rot, accel, raw)
+        if timed :
+            readTime = time.monotonic() - readStart
+        dCfg.last_read = now
+        if dCfg.stale : # first good read after a fault (one delta, from this thread)
+            dCfg.stale = False
+            logger.info(dCfg.source + " reading again")
+            publishStatus(dCfg, 'ok')
+        # the calibration tracker talks to the sensor: stepped here, its status sent by the consumer
+        calibration = attitude and dCfg.calibration is not None and dCfg.calibration.step(bno, busLock, now)
+        o = ring.slot()
+        if o is not None : # else the consumer is lagging: sample dropped (and counted)
+            data[o] = now
+            data[o + 1] = (attitude and S_ATTITUDE) | (rot and S_GYRO) | (accel and S_ACCEL) | (raw and S_RAW) | (calibration and S_CALIB)
+            if attitude :
+                data[o + 2], data[o + 3], data[o + 4], data[o + 5] = quaternion
+            if rot :
+                data[o + 6], data[o + 7], data[o + 8] = gyro
+            if accel :
+                data[o + 9], data[o + 10], data[o + 11] = acceleration
+            if raw :
+                data[o + 12], data[o + 13], data[o + 14] = magnetic
+                data[o + 15] = calibration_status
+            data[o + 16] = readTime
+            ring.commit()
+        if scheduler.ticks % stats_ticks == 0:
+            logger.info(dCfg.source + " tick statistics: " + json.dumps(dict(scheduler.stats(), **ring.stats())))
+
+RECOVERY_MIN = 0.1 # secs, first retry after a fault
+RECOVERY_MAX = 5.0 # secs, bound of the exponential backoff
+RECOVERY_HEALTHY = 10.0 # secs of good reads after which the backoff restarts from RECOVERY_MIN
+
+def i2cReconnect(bus, dCfg, busLock):
+    # new BNO08X_I2C object, from the second attempt on a new busio.I2C (the bus may be stuck)
+    # unless the other devices are still reading it: re-creating it would make them fault too
+    def connect(attempt):
+        with busLock :
+            if attempt > 1 and not bus.inUse(dCfg, time.monotonic()) :
+                bus.reopen()
+            return i2cBackend(bus.i2c, dCfg.addr)
+    return connect
+
+def publishStatus(dCfg, status):
+    skOutputDelta(skTemplate(dCfg.source), [{'path': dCfg.imu_path + '.status', 'value': status}])
+
+def deviceSupervisor(bno, connect, dCfg, busLock):
+    """
+    Runs the acquisition of a device and brings it back after a fault (I2C
+    error, sensor reset, library exception): the sensor is reconnected by
+    'connect(attempt)' and its reports enabled again, retrying with bounded
+    exponential backoff. Status 'stale' is sent at the fault and 'ok' when
+    the sensor is read again; the other devices keep reporting meanwhile.
+    """
+    backoff = RECOVERY_MIN
+    while True:
+        started = time.monotonic()
+        try:
+            sensorReportLoop(bno, dCfg, busLock)
+        except Exception as e:
+            if dCfg.perf is not None :
+                dCfg.perf.faults += 1
+            logger.error(dCfg.source + " read fault: " + repr(e))
+        if not dCfg.stale : # else still not read since the previous fault
+            dCfg.stale = True
+            publishStatus(dCfg, 'stale')
+        fault = time.monotonic()
+        if fault - started > RECOVERY_HEALTHY :
+            backoff = RECOVERY_MIN
+        attempt = 0
         while True:
-            time.sleep(0.1)
-            mag_x, mag_y, mag_z = bno.magnetic
-            (
-                game_quat_i,
-                game_quat_j,
-                game_quat_k,
-                game_quat_real,
-            ) = bno.game_quaternion
-            calibration_status = bno.calibration_status
-            if calibration_status < 2:
-                calibration_good = False
-                calibration_good_at = None
-            if not calibration_good and calibration_status >= 2:
-                calibration_good_at = time.monotonic()
-                calibration_good = True
-            current_time = time.monotonic()
-            if calibration_good and (current_time - calibration_good_at > 5.0):
-                # wait 5 seconds to let calib being stabilized
+            time.sleep(backoff)
+            backoff = min(2 * backoff, RECOVERY_MAX)
+            attempt += 1
+            try:
+                bno = connect(attempt)
+                with busLock :
+                    enableReports(bno, dCfg)
                 break
-            if (current_time - start_time) > 50.0 :
-                logger.critical (' Calibration timeout !!!')
-                raise ValueError (' CALIBRATION TIMEOUT ERROR')
-        print ("Calibrate obtained in "+ repr(current_time-start_time) + ' fractional sec.')
-        print ('Calibration status = ' + repr(calibration_status))
-        print ('Calibration accuracy: ' + adafruit_bno08x.REPORT_ACCURACY_STATUS[calibration_status])
-        print ("=============== "+ source + " CALIBRATION END =========================")
-        bno.save_calibration_data()
-        sys.stdout.flush()
-    sys.stdout = sys.__stdout__ # restore normal stdout behavior
-    skOutput(mySource,'sensors.magnetometer.calibration_status',calibration_status)
-    skOutput(mySource,'sensors.magnetometer.calibration_quality',adafruit_bno08x.REPORT_ACCURACY_STATUS[calibration_status])
-    sys.stdout.flush()
-    logger.info("calibration done")
-
-    
-# main entry (enable logging and check device configurations)
+            except Exception as e:
+                logger.error(dCfg.source + " reconnection " + str(attempt) + " failed: " + repr(e))
+        logger.info(dCfg.source + " reconnected after " + "{:.1f}".format(time.monotonic() - fault) + " s")
+        if dCfg.calibration is not None : # the sensor was reset: its stored calibration is validated again
+            dCfg.calibration = calibrationTracker(dCfg.source)
 
-myConfigList: list[pluginConfig] = []
+SAMPLE_ERRORS_LOG = 100 # conversion/output errors of a device logged once every 100
 
+def sampleConsumer(dCfg, ring):
+    """
+    Attitude, corrections and deltas of the samples stored by sensorReportLoop.
+    A sample that cannot be converted or recorded is skipped and counted in
+    'sampleErrors'; a closed output pipe ends the process (skOutputDelta).
+    """
+    times_for_calib_status_update = 100 # calibration status sent every 100 times the normal attitude delta is sent
+    template = skTemplate(dCfg.source)
+    data = ring.data
+    slots = ring.slots
+    perf = dCfg.perf
+    while True:
+        ring.ready.wait()
+        ring.ready.clear()
+        while ring.tail < ring.head:
+            tail = ring.tail
+            try:
+                o = (tail % slots) * SLOT_SIZE
+                now = data[o]
+                flags = int(data[o + 1])
+                if not dCfg.pending.empty() and applyOptions(dCfg) :
+                    dCfg.reschedule = True # new rates, applied by the acquisition
+                values = []
+                if flags & S_ATTITUDE :
+                    game_quat_i, game_quat_j, game_quat_k, game_quat_real = data[o + 2], data[o + 3], data[o + 4], data[o + 5]
+                    if flags & S_RAW : # the raw stream (with the magnetometer too) is recorded for offline replay
+                        dCfg.recorder.record(now, (game_quat_i, game_quat_j, game_quat_k, game_quat_real),
+                                             (data[o + 12], data[o + 13], data[o + 14]), int(data[o + 15]))
+                    if game_quat_i or game_quat_j or game_quat_k or game_quat_real : # not a placeholder reading
+                        roll, pitch, yaw = find_attitude(game_quat_real, game_quat_i, game_quat_j, game_quat_k)
+                        values = attitudeValues(dCfg, *applyCorrections(dCfg, roll, pitch, yaw))
+                if flags & (S_GYRO | S_ACCEL) :
+                    gyro = (data[o + 6], data[o + 7], data[o + 8]) if flags & S_GYRO else None
+                    acceleration = (data[o + 9], data[o + 10], data[o + 11]) if flags & S_ACCEL else None
+                    values += motionValues(dCfg, gyro, acceleration) # sent in the same delta
+                if flags & S_ATTITUDE and dCfg.calibration is not None :
+                    # sent when it changes and anyway every 100 attitude deltas
+                    times_for_calib_status_update -= 1
+                    if flags & S_CALIB or times_for_calib_status_update <= 0 :
+                        times_for_calib_status_update = 100
+                        values += dCfg.calibration.values()
+                readTime = data[o + 16]
+                ring.tail += 1 # the slot can be reused
+                if dCfg.emission is not None :
+                    values = dCfg.emission.filter(values, now)
+                if values :
+                    skOutputDelta(template, values) # a single delta for all the paths of the sample
+                if perf is not None :
+                    done = time.monotonic()
+                    perf.sample(readTime, done - now, done) # latency includes the time spent in the ring
+            except Exception as e: # the sample is skipped, the output of the device goes on
+                ring.tail = tail + 1
+                ring.errors += 1
+                if ring.errors % SAMPLE_ERRORS_LOG == 1 :
+                    logger.error(dCfg.source + " sample not sent (" + str(ring.errors) + " errors): " + repr(e))
 
-basic_logger = logging.getLogger(__name__)
-logger = CustomAdapter(basic_logger, {'pluginid': "sk-py-bno08x"})
-logging.basicConfig(stream = sys.stderr, level = logging.DEBUG)
-logging.getLogger("adafruit_bno08x").setLevel(logging.WARNING)
+def perfPublisher(configs):
+    # a thread of its own: 'timeSinceLastSample' keeps growing when a report loop is stuck
+    interval = min(dCfg.perf.interval for dCfg in configs if dCfg.perf is not None)
+    # first values after a whole interval: none would have been sampled yet at startup
+    now = time.monotonic()
+    due = {dCfg.source: now + dCfg.perf.interval for dCfg in configs if dCfg.perf is not None}
+    due[None] = now + interval
+    while True:
+        now = time.monotonic()
+        for dCfg in configs:
+            if dCfg.perf is not None and now >= due[dCfg.source]:
+                skOutputDelta(skTemplate(dCfg.source), dCfg.perf.values(now))
+                due[dCfg.source] = now + dCfg.perf.interval
+        if now >= due[None]: # process values, at the shortest interval of the devices
+            skOutputDelta(skTemplate(package_name), processPerfValues())
+            due[None] = now + interval
+        time.sleep(1.0)
+
+def perfDump(configs):
+    # SIGUSR1: current telemetry of every device to the plugin log
+    now = time.monotonic()
+    logger.info("process performance: " + json.dumps({v['path'].rsplit('performance.', 1)[1]: v['value']
+                                                       for v in processPerfValues()}))
+    for dCfg in configs:
+        if dCfg.perf is not None:
+            logger.info(dCfg.source + " performance: " + json.dumps({v['path'].rsplit('performance.', 1)[1]: v['value']
+                                                                     for v in dCfg.perf.values(now)}))
+        if dCfg.scheduler is not None and dCfg.ring is not None:
+            logger.info(dCfg.source + " tick statistics: " + json.dumps(dict(dCfg.scheduler.stats(), **dCfg.ring.stats())))
+
+def reconfigure(config):
+    # new options of the devices, applied by their report loop between two samples
+    for options in config["imuDevices"]:
+        found = False
+        for dCfg in myConfigList:
+            if dCfg.name == options["devName"]:
+                dCfg.pending.put(options)
+                found = True
+        if not found:
+            logger.warning("device '" + hex(options["devName"]) + "' not running: a restart of the plugin is needed")
+
+def applyOptions(dCfg):
+    """
+    Applies the options received by the control channel (dCfg.pending) to a
+    running device: offsets, deviation, deadbands, rates and declination.
+    Called by the consumer between two samples, so a sample never mixes
+    old and new settings. Returns True when the rates changed (the sensor
+    reports and the tick are then changed by the acquisition).
+    """
+    while not dCfg.pending.empty(): # the consumer is the only reader
+        options = dCfg.pending.get() # the last options received replace the older ones
+    try:
+        new = pluginConfigFromOptions(options)
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error(dCfg.source + " options not applied: " + repr(e))
+        return False
+    limitRates(new, dCfg.backend)
+    dCfg.hdgOffset = new.hdgOffset
+    dCfg.hdgDeviation = new.hdgDeviation
+    dCfg.rollOffset = new.rollOffset
+    dCfg.pitchOffset = new.pitchOffset
+    dCfg.deviation = new.deviation
+    dCfg.emission = new.emission
+    if new.decl_estimate != dCfg.decl_estimate:
+        dCfg.decl_estimate = new.decl_estimate
+        dCfg.decl_rad = new.decl_rad # until the next declination update
+        dCfg.decl_updated = True
+    decl = (new.decl_needed, new.decl_interval, new.decl_model, new.decl_model_interval)
+    if decl != (dCfg.decl_needed, dCfg.decl_interval, dCfg.decl_model, dCfg.decl_model_interval):
+        # the worker resolves the declination again (a NOAA query, without the model)
+        dCfg.decl_needed, dCfg.decl_interval, dCfg.decl_model, dCfg.decl_model_interval = decl
+        dCfg.decl_wakeup.set()
+    rates = (new.rate, new.delay, new.rot_rate, new.accel_rate, new.tick_policy)
+    changed = rates != (dCfg.rate, dCfg.delay, dCfg.rot_rate, dCfg.accel_rate, dCfg.tick_policy)
+    if changed:
+        dCfg.rate, dCfg.delay, dCfg.rot_rate, dCfg.accel_rate, dCfg.tick_policy = rates
+    logger.info(dCfg.source + " options applied")
+    return changed
 
-# Source - https://stackoverflow.com/a/11029841
-# Posted by aknuds1, modified by community. See post 'Timeline' for change history
-# Retrieved 2026-02-02, License - CC BY-SA 3.0
+def controlChannel():
+    """
+    Configuration lines written by the parent process on stdin: read by a
+    thread of their own, the new options are applied by the running report
+    loops without restarting the process.
+    """
+    for line in iter(sys.stdin.readline, ''): # '' at EOF, i.e. when the parent process has gone
+        try:
+            data = json.loads(line)
+        except ValueError:
+            sys.stderr.write('error parsing json\n')
+            sys.stderr.write(line)
+            continue
+        if "imuDevices" in data:
+            reconfigure(data)
+
+# main entry (enable logging and check device configurations)
 
-logging.getLogger("requests").setLevel(logging.WARNING)
-logging.getLogger("urllib3").setLevel(logging.WARNING)
+myConfigList: list[pluginConfig] = []
 
-config = json.loads(input())
+package_name = 'sk-py-bno08x'
 
-for options in config["imuDevices"]:
+basic_logger = logging.getLogger(__name__)
+logger = CustomAdapter(basic_logger, {'pluginid': package_name})
 
+def pluginConfigFromOptions(options):
     plgCfg = pluginConfig(options["devName"],
                           options["devRefresh"],
                           options["devDelayReports"],
@@ -321,52 +1286,154 @@ for options in config["imuDevices"]:
                           options["devHdgOffset"],
                           options["devHdgDeviation"],
                           options["devRollOffset"],
-                          options["devPitchOffset"])
-    myConfigList.append(plgCfg)
-    
-    global my_source
-    global my_source_addr_part
-    global decl_rad
-
-    i2c = busio.I2C(board.SCL, board.SDA)
-    try:
-        addr = scan_for_bno(i2c)
-    except ValueError as e:
-        logger.critical(e)
-    #
-    if addr != plgCfg.name :
-        logger.critical("THE CONFIGURED ADDRESS VALUE '" + hex[plgCfg.name] + "'" +" IS DIFFERENT FROM THE ONE FOUND --> '" + hex[addr] + "'")
-    package_name = 'sk-py-bno08x'
-    my_source_addr_part = 'I2C_at['+hex(addr)+']'
-    my_source = package_name + '.' + my_source_addr_part
-    rRate = 1/plgCfg.rate # convert reports/sec in secs btw reports
-    bno = BNO08X_I2C(i2c, reset=None , address= addr, debug=False)
-    if plgCfg.calib_needed :
-        sensorCalibrate(addr, my_source_addr_part, bno)
-    else :
-        with open ('debug.log', 'a') as sys.stdout :
-            bno.enable_feature(BNO_REPORT_MAGNETOMETER)
-            bno.enable_feature(BNO_REPORT_GAME_ROTATION_VECTOR)
-            time.sleep(0.2)
-            sys.stdout.flush()
-        sys.stdout = sys.__stdout__ # restore normal stdout file object
-        
-    sys.stdout.flush() #to guarantee that output buffer is clean after bno calib/enable features
-    time.sleep(0.2)
-    
-    # set the estimate defined in schema as the initial default value
-    decl_rad = plgCfg.decl_estimate * pi/180 # choosen to use degrees for user input in config
-    if plgCfg.decl_needed :
-        decl_rad = getDeclination()
-        skOutput( my_source_addr_part, 'navigation.magneticVariation', decl_rad )
-        logger.info ("navigation.magneticVariation initialized")
-
-    sensorReportLoop(my_source_addr_part, rRate, bno, plgCfg)    
-
-for line in iter(sys.stdin.readline, b''):
-    try:
-        data = json.loads(line)
-        sys.stderr.write(json.dumps(data))
-    except:
-        sys.stderr.write('error parsing json\n')
-        sys.stderr.write(line)
+                          options["devPitchOffset"],
+                          options.get("devDeclModel", True),
+                          options.get("devDeclModelInterval", 10),
+                          options.get("devTickPolicy", 'drop'))
+    plgCfg.deviation = deviationTable.fromOptions(options)
+    plgCfg.emission = emissionPolicyFromOptions(options)
+    plgCfg.rot_rate = options.get("devRateOfTurnRate", 0)
+    plgCfg.accel_rate = options.get("devAccelerationRate", 0)
+    plgCfg.backend = options.get("devBackend", "i2c")
+    return plgCfg
+
+def limitRates(plgCfg, backend):
+    # the rates the backend of the device can deliver (at startup and on live changes)
+    if backend == "replay" and (plgCfg.rot_rate or plgCfg.accel_rate) :
+        logger.warning("gyro and acceleration are not recorded: rate of turn and acceleration disabled")
+        plgCfg.rot_rate = plgCfg.accel_rate = 0
+
+def emissionPolicyFromOptions(options):
+    # opt-in: without deadbands every sample is sent (steady rate for autopilots and NMEA 2000 bridges)
+    heading = options.get("devDeadbandHeading", 0) * pi/180
+    attitude = options.get("devDeadbandAttitude", 0) * pi/180
+    if heading <= 0 and attitude <= 0:
+        return None
+    deadbands = {'navigation.attitude': attitude,
+                 'navigation.headingCompass': heading,
+                 'navigation.headingMagnetic': heading,
+                 'navigation.headingTrue': heading}
+    # a path without deadband is always sent: left out, its noise would keep the full rate hold on
+    deadbands = {path: deadband for path, deadband in deadbands.items() if deadband > 0}
+    return emissionPolicy(deadbands, options.get("devHeartbeat", 2), options.get("devActiveHold", 2))
+
+def main():
+    logging.basicConfig(stream = sys.stderr, level = logging.DEBUG)
+    logging.getLogger("adafruit_bno08x").setLevel(logging.WARNING)
+
+    # Source - https://stackoverflow.com/a/11029841
+    # Posted by aknuds1, modified by community. See post 'Timeline' for change history
+    # Retrieved 2026-02-02, License - CC BY-SA 3.0
+
+    logging.getLogger("requests").setLevel(logging.WARNING)
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+    config = json.loads(input())
+
+    # stopped by the parent process: exit normally so that logs and recordings are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # whatever is printed (mainly by the adafruit library) goes to debug.log through
+    # a ring buffer: stdout of the process is reserved to the deltas (sys.__stdout__)
+    sys.stdout = ringLog('debug.log').start()
+
+    # optional batched output: several deltas per write/flush (pipe syscalls) to the server
+    global skFrame
+    if config.get("outputFrameDeltas", 1) > 1:
+        skFrame = skFrameWriter(skStream, config["outputFrameDeltas"], config.get("outputFrameInterval", 50) / 1000).start()
+
+    global skStreamEnabled
+    skStreamEnabled = config.get("skStream", True)
+
+    # one I2C bus shared by all the configured devices: every transaction on it holds busLock
+    busLock = threading.Lock()
+    i2cNames = [options["devName"] for options in config["imuDevices"] if options.get("devBackend", "i2c") not in ("sim", "replay")]
+    i2cAddresses = [] # address of each i2c device, in config order
+    if i2cNames:
+        bus = i2cBus()
+        try:
+            i2cAddresses = assignAddresses(i2cNames, scan_for_bno(bus.i2c))
+        except ValueError as e:
+            logger.critical(e)
+            raise
+
+    threads = []
+
+    for options in config["imuDevices"]:
+
+        plgCfg = pluginConfigFromOptions(options)
+
+        backend = options.get("devBackend", "i2c")
+        if backend == "sim" : # synthetic sensor, no I2C bus involved
+            plgCfg.addr = plgCfg.name
+            plgCfg.source = 'SIM_at['+hex(plgCfg.name)+']'
+        elif backend == "replay" : # recorded sensor stream
+            plgCfg.addr = plgCfg.name
+            plgCfg.source = 'REPLAY_at['+hex(plgCfg.name)+']'
+            limitRates(plgCfg, backend)
+        else :
+            addr = i2cAddresses.pop(0)
+            if addr is None :
+                continue
+            plgCfg.addr = addr
+            plgCfg.source = 'I2C_at['+hex(addr)+']'
+        plgCfg.skSource = package_name + '.' + plgCfg.source
+        plgCfg.imu_path = imuPath(plgCfg.source)
+        myConfigList.append(plgCfg)
+        if options.get("devPerfInterval", 60) > 0 :
+            plgCfg.perf = perfMonitor(plgCfg.source, options.get("devPerfInterval", 60))
+
+        # declination is resolved in background while the sensor is brought up:
+        # headingTrue starts with the estimate (the worker idles if not required,
+        # ready for the declination to be enabled by the control channel)
+        threading.Thread(target=declinationWorker, args=(plgCfg,),
+                         name=plgCfg.source + '.declination', daemon=True).start()
+
+        if backend == "sim" :
+            bno = simBackend()
+            connect = lambda attempt, bno = bno: bno
+        elif backend == "replay" :
+            from recording import replayBackend
+            bno = replayBackend(options["devReplayFile"])
+            connect = lambda attempt, bno = bno: bno
+        else :
+            bno = i2cBackend(bus.i2c, plgCfg.addr)
+            connect = i2cReconnect(bus, plgCfg, busLock)
+            bus.devices.append(plgCfg)
+        if options.get("devRecordFile") :
+            from recording import sensorRecorder
+            plgCfg.recorder = sensorRecorder(options["devRecordFile"], plgCfg.source)
+            atexit.register(plgCfg.recorder.close)
+            logger.info("recording " + plgCfg.source + " raw samples to " + plgCfg.recorder.path)
+
+        if options.get("devIntPin") and backend == "i2c" :
+            plgCfg.int_pin = openIntPin(options["devIntPin"])
+
+        if plgCfg.calib_needed : # validated/refined by the report loop: no wait at startup
+            plgCfg.calibration = calibrationTracker(plgCfg.source)
+        enableReports(bno, plgCfg) # report intervals matching the refresh rate
+
+        # every device runs its own report loop (and its own refresh rate), restarted after a fault
+        threads.append(threading.Thread(target=deviceSupervisor, args=(bno, connect, plgCfg, busLock),
+                                        name=plgCfg.source, daemon=True))
+
+    if any(c.perf is not None for c in myConfigList) :
+        threads.append(threading.Thread(target=perfPublisher, args=(myConfigList,), name='performance', daemon=True))
+    # kill -USR1 <pid>: telemetry and tick statistics of every device to the plugin log
+    signal.signal(signal.SIGUSR1, lambda signum, frame: perfDump(myConfigList))
+
+    for t in threads:
+        t.start()
+
+    threading.Thread(target=controlChannel, name='control', daemon=True).start()
+
+    # stdin closed but the process not killed: keep reporting, until the server
+    # closes the pipe of the deltas (no one left to read them) or SIGTERM
+    outputClosed.wait()
+    logger.error("Signal K output closed: exiting")
+    # what is left in the stdout buffer is discarded, not flushed to the closed pipe at exit
+    os.dup2(os.open(os.devnull, os.O_WRONLY), skStream.fileno())
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+Binary recording of the raw sensor stream and its replay.
+
+A recording is a 24 bytes header followed by fixed size little-endian
+records (RECORD_FORMAT): monotonic timestamp, game quaternion (i, j, k, real),
+magnetometer (x, y, z micro Tesla) and calibration status. Files can be
+memory mapped and read with struct.iter_unpack (or numpy.frombuffer with
+RECORD_DTYPE) without parsing.
+
+Replay of a recording through find_attitude and the delta pipeline, as fast
+as possible:
+
+    python3 recording.py FILE [--config OPTIONS.json] [--out DELTAS.txt]
+
+OPTIONS.json is the plugin configuration (the first item of 'imuDevices' is
+used for offsets, deviation and declination estimate). With --stats the
+whole recording is converted at once (NumPy, find_attitude_batch) and only
+attitude and calibration statistics are printed.
+"""
+
+import sys, time, json, struct, mmap, datetime, argparse
+
+from backends import sensorBackend
+
+MAGIC = b'BNO8REC1'
+HEADER_FORMAT = '<8sdd' # magic, wall clock (epoch secs) and monotonic time at start
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_FORMAT = '<d4f3fB3x' # t, quaternion i j k real, magnetic x y z, calibration status
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+RECORD_DTYPE = [('t', '<f8'), ('quat', '<f4', (4,)), ('mag', '<f4', (3,)), ('calib', 'u1'), ('pad', 'V3')]
+
+class sensorRecorder():
+    """
+    Appends the raw samples of a device to 'prefix_<source>_<UTC time>.bnorec'.
+    Records are packed in a preallocated buffer written every 'batch' samples.
+    """
+    def __init__(self, prefix, source, batch = 64):
+        stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        name = ''.join(c for c in source if c.isalnum() or c in '._-')
+        self.path = prefix + '_' + name + '_' + stamp + '.bnorec'
+        self.file = open(self.path, 'wb')
+        self.file.write(struct.pack(HEADER_FORMAT, MAGIC, time.time(), time.monotonic()))
+        self.batch = batch
+        self.buffer = bytearray(batch * RECORD_SIZE)
+        self.count = 0
+
+    def record(self, t, quaternion, magnetic, calibration_status):
+        struct.pack_into(RECORD_FORMAT, self.buffer, self.count * RECORD_SIZE,
+                         t, *quaternion, *magnetic, calibration_status)
+        self.count += 1
+        if self.count == self.batch:
+            self.flush()
+
+    def flush(self):
+        self.file.write(memoryview(self.buffer)[:self.count * RECORD_SIZE])
+        self.file.flush()
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+class sensorRecording():
+    """ a recording memory mapped (read only) """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, self.wallStart, self.monotonicStart = struct.unpack_from(HEADER_FORMAT, self.map)
+        if magic != MAGIC:
+            raise ValueError(path + " is not a BNO08x recording")
+        self.records = memoryview(self.map)[HEADER_SIZE:]
+        usable = len(self.records) - len(self.records) % RECORD_SIZE # a truncated last record is ignored
+        self.records = self.records[:usable]
+
+    def __len__(self):
+        return len(self.records) // RECORD_SIZE
+
+    def __iter__(self):
+        """ (t, qi, qj, qk, qr, mx, my, mz, calibration_status) tuples """
+        return struct.iter_unpack(RECORD_FORMAT, self.records)
+
+    def array(self):
+        """ numpy structured array (RECORD_DTYPE) over the mapped file, no copy """
+        import numpy
+        return numpy.frombuffer(self.records, dtype = numpy.dtype(RECORD_DTYPE))
+
+class replayBackend(sensorBackend):
+    """
+    Sensor backend playing a recording back at its original pace (looping
+    at the end): readings return the last record due at the current time.
+    """
+    def __init__(self, path):
+        self.samples = list(sensorRecording(path))
+        if not self.samples:
+            raise ValueError(path + " is empty")
+        self.index = 0
+        self.start = time.monotonic()
+        self.offset = self.samples[0][0]
+        self.duration = self.samples[-1][0] - self.offset
+
+    def _sample(self):
+        t = (time.monotonic() - self.start) % max(self.duration, 1e-3) + self.offset
+        samples = self.samples
+        if t < samples[self.index][0]: # looped
+            self.index = 0
+        while self.index + 1 < len(samples) and samples[self.index + 1][0] <= t:
+            self.index += 1
+        return samples[self.index]
+
+    @property
+    def game_quaternion(self):
+        return self._sample()[1:5]
+
+    @property
+    def magnetic(self):
+        return self._sample()[5:8]
+
+    @property
+    def calibration_status(self):
+        return self._sample()[8]
+
+    def enable_feature(self, feature_id, report_interval = None):
+        pass
+
+    def begin_calibration(self):
+        pass
+
+    def save_calibration_data(self):
+        pass
+
+def replay(path, options, out):
+    """ feeds a recording through the delta pipeline, returns the count of the samples sent """
+    import plugin
+    dCfg = plugin.pluginConfigFromOptions(options)
+    dCfg.source = 'REPLAY_at[' + hex(dCfg.name) + ']'
+    template = plugin.skTemplate(dCfg.source)
+    find_attitude = plugin.find_attitude
+    applyCorrections = plugin.applyCorrections
+    attitudeValues = plugin.attitudeValues
+    write = out.write
+    recording = sensorRecording(path)
+    wallOffset = recording.wallStart - recording.monotonicStart
+    utcfromtimestamp = datetime.datetime.utcfromtimestamp
+    count = 0
+    for t, qi, qj, qk, qr, mx, my, mz, calibration_status in recording:
+        if not (qi or qj or qk or qr) : # placeholder reading after a sensor enable: not converted, as live
+            continue
+        roll, pitch, yaw = find_attitude(qr, qi, qj, qk)
+        values = attitudeValues(dCfg, *applyCorrections(dCfg, roll, pitch, yaw))
+        write(template.dumps(values, utcfromtimestamp(t + wallOffset).isoformat()) + '\n') # time of the recording
+        count += 1
+    out.flush()
+    return count
+
+def attitudes(recording):
+    """
+    roll, pitch, yaw arrays (radians, uncorrected) of a whole recording,
+    placeholder (all-zero) quaternions left out
+    """
+    import plugin
+    quat = recording.array()['quat'] # i, j, k, real
+    quat = quat[quat.any(axis = 1)]
+    return plugin.find_attitude_batch(quat[:, [3, 0, 1, 2]])
+
+def stats(path, out):
+    import numpy as np
+    recording = sensorRecording(path)
+    samples = recording.array()
+    roll, pitch, yaw = attitudes(recording)
+    t = samples['t']
+    print("samples: {}  duration: {:.1f} s".format(len(samples), t[-1] - t[0] if len(t) else 0.0), file = out)
+    if len(yaw) < len(samples):
+        print("placeholder readings (not converted): {}".format(len(samples) - len(yaw)), file = out)
+    if len(yaw):
+        for name, angle in (("roll", roll), ("pitch", pitch)):
+            deg = np.degrees(angle)
+            print("{:<6s} mean {:7.2f}  std {:6.2f}  min {:7.2f}  max {:7.2f} deg".format(
+                  name, deg.mean(), deg.std(), deg.min(), deg.max()), file = out)
+        heading = np.degrees(np.angle(np.exp(1j * yaw).mean())) % 360 # circular mean
+        print("heading circular mean {:.1f} deg".format(heading), file = out)
+    counts = np.bincount(samples['calib'], minlength = 4)
+    print("calibration status (0..3): " + " ".join("{:.1%}".format(c / max(1, len(samples))) for c in counts), file = out)
+
+def main():
+    parser = argparse.ArgumentParser(description = "replay of a BNO08x recording through the delta pipeline")
+    parser.add_argument("file", help = "recording (.bnorec)")
+    parser.add_argument("--config", help = "plugin configuration (JSON), first item of 'imuDevices'")
+    parser.add_argument("--out", help = "deltas output file (default: stdout)")
+    parser.add_argument("--stats", action = "store_true", help = "print attitude/calibration statistics only")
+    args = parser.parse_args()
+    if args.stats:
+        stats(args.file, sys.stdout)
+        return
+    options = {"devName": 0x4b, "devRefresh": 1, "devDelayReports": 0, "devCalibRequired": False,
+               "devDeclRequired": False, "devDeclInterval": 5, "devDeclEstimate": 0,
+               "devHdgOffset": 0, "devHdgDeviation": 0, "devRollOffset": 0, "devPitchOffset": 0}
+    if args.config:
+        with open(args.config) as f:
+            options.update(json.load(f)["imuDevices"][0])
+    out = open(args.out, 'w') if args.out else sys.stdout
+    import plugin # not timed
+    start = time.perf_counter()
+    count = replay(args.file, options, out)
+    elapsed = time.perf_counter() - start
+    print("{} samples replayed in {:.3f} s ({:.0f} samples/s)".format(count, elapsed, count / elapsed), file = sys.stderr)
+
+if __name__ == '__main__':
+    main()
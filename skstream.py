@@ -0,0 +1,173 @@
+"""
+Streaming subscription to the Signal K server: a websocket on
+/signalk/v1/stream (stdlib only, the subset of RFC 6455 a client needs)
+keeps an in-memory snapshot of the subscribed paths, per $source, updated
+as the server pushes its deltas. Readers get the last values without any
+request to the server; the connection is restored in background (with
+exponential backoff) when the server restarts.
+"""
+
+import os, json, time, base64, socket, hashlib, struct, threading, logging
+
+WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+RECONNECT_MIN = 1.0 # secs
+RECONNECT_MAX = 60.0
+
+logger = logging.getLogger(__name__)
+
+class wsClosed(Exception):
+    pass
+
+def wsFrame(payload, opcode = 0x1, mask = True):
+    """ a single (final) frame: client frames are masked, server frames are not """
+    n = len(payload)
+    if n < 126:
+        header = struct.pack('!BB', 0x80 | opcode, (0x80 if mask else 0) | n)
+    elif n < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, (0x80 if mask else 0) | 126, n)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, (0x80 if mask else 0) | 127, n)
+    if not mask:
+        return header + payload
+    key = os.urandom(4)
+    return header + key + wsMask(payload, key)
+
+def wsMask(payload, key):
+    # XOR with the repeated 4 bytes key, as one big integer operation
+    keys = (key * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(keys, 'big')).to_bytes(len(payload), 'big')
+
+def wsReadFrame(rfile):
+    """ (fin, opcode, payload) of the next frame, unmasked """
+    head = rfile.read(2)
+    if len(head) < 2:
+        raise wsClosed('connection closed')
+    b0, b1 = head
+    n = b1 & 0x7f
+    if n == 126:
+        n = struct.unpack('!H', rfile.read(2))[0]
+    elif n == 127:
+        n = struct.unpack('!Q', rfile.read(8))[0]
+    key = rfile.read(4) if b1 & 0x80 else None
+    payload = rfile.read(n)
+    if len(payload) < n:
+        raise wsClosed('connection closed')
+    if key:
+        payload = wsMask(payload, key)
+    return bool(b0 & 0x80), b0 & 0x0f, payload
+
+def wsAccept(key):
+    return base64.b64encode(hashlib.sha1(key + WS_GUID).digest())
+
+class wsConnection():
+    """ websocket client connection: text messages, ping/pong and close """
+    def __init__(self, host, port, path, timeout = 5.0):
+        self.sock = socket.create_connection((host, port), timeout = timeout)
+        key = base64.b64encode(os.urandom(16))
+        self.sock.sendall(b'GET ' + path.encode() + b' HTTP/1.1\r\n'
+                          b'Host: ' + host.encode() + b':' + str(port).encode() + b'\r\n'
+                          b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                          b'Sec-WebSocket-Key: ' + key + b'\r\nSec-WebSocket-Version: 13\r\n\r\n')
+        self.rfile = self.sock.makefile('rb')
+        status = self.rfile.readline()
+        headers = {}
+        while True:
+            line = self.rfile.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.partition(b':')
+            headers[name.strip().lower()] = value.strip()
+        if status.split()[1:2] != [b'101'] or headers.get(b'sec-websocket-accept') != wsAccept(key):
+            self.sock.close()
+            raise ConnectionError("websocket handshake refused: " + status.decode('latin-1').strip())
+        self.sock.settimeout(None) # the server pushes at its own pace
+        self.sendLock = threading.Lock()
+
+    def send(self, payload, opcode = 0x1):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        with self.sendLock:
+            self.sock.sendall(wsFrame(payload, opcode))
+
+    def recv(self):
+        """ next text message (fragments joined, control frames handled) """
+        fragments = []
+        while True:
+            fin, opcode, payload = wsReadFrame(self.rfile)
+            if opcode == 0x8:
+                raise wsClosed('closed by the server')
+            if opcode == 0x9:
+                self.send(payload, 0xA) # pong
+                continue
+            if opcode == 0xA:
+                continue
+            fragments.append(payload)
+            if fin:
+                return b''.join(fragments).decode()
+
+    def close(self):
+        try:
+            self.send(b'', 0x8)
+        except OSError:
+            pass
+        self.sock.close()
+
+class skSubscription():
+    """
+    Snapshot of 'paths' of vessels.self kept up to date by a background
+    thread: get(path) returns the last value received (from 'source' only,
+    if given), None when not received yet. 'connected' tells whether the
+    snapshot is live: readers should use the REST API when it is False.
+    """
+    def __init__(self, host, port, paths):
+        self.host = host
+        self.port = port
+        self.paths = set(paths)
+        self.latest = {} # path -> last value, whatever its source
+        self.bySource = {} # path -> {$source: last value}
+        self.connected = False
+        self.received = 0 # deltas
+
+    def get(self, path, source = None):
+        if source is None:
+            return self.latest.get(path)
+        return self.bySource.get(path, {}).get(source)
+
+    def update(self, delta):
+        for update in delta.get('updates', ()):
+            source = update.get('$source')
+            for v in update.get('values', ()):
+                path = v.get('path')
+                if path in self.paths:
+                    value = v.get('value')
+                    self.latest[path] = value
+                    self.bySource.setdefault(path, {})[source] = value
+        self.received += 1
+
+    def subscribeMessage(self):
+        return json.dumps({'context': 'vessels.self',
+                           'subscribe': [{'path': path, 'policy': 'instant'} for path in sorted(self.paths)]})
+
+    def run(self):
+        backoff = RECONNECT_MIN
+        while True:
+            try:
+                ws = wsConnection(self.host, self.port, '/signalk/v1/stream?subscribe=none')
+                try:
+                    ws.send(self.subscribeMessage())
+                    self.connected = True
+                    backoff = RECONNECT_MIN
+                    logger.info("subscribed to " + ", ".join(sorted(self.paths)))
+                    while True:
+                        self.update(json.loads(ws.recv()))
+                finally:
+                    self.connected = False
+                    ws.close()
+            except (OSError, wsClosed, ValueError) as e:
+                logger.warning("Signal K stream unavailable (" + repr(e) + "): retry in " + str(backoff) + " s")
+            time.sleep(backoff)
+            backoff = min(2 * backoff, RECONNECT_MAX)
+
+    def start(self):
+        threading.Thread(target=self.run, name='signalk.stream', daemon=True).start()
+        return self
@@ -0,0 +1,181 @@
+"""
+World Magnetic Model declination, computed offline from the spherical harmonic
+coefficients of 'WMM.COF' (the NOAA/NCEI coefficient file, public domain,
+replace it with the new one when a new model is released every 5 years).
+
+The model is evaluated once per position cell (0.1 x 0.1 degrees) and per
+tenth of year: results are memoized in an LRU cache so that repeated lookups
+along the route cost a dictionary access.
+"""
+
+import os, datetime, logging
+
+from functools import lru_cache
+from math import sin, cos, atan2, sqrt, pi
+
+WMM_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'WMM.COF')
+
+CELL_DEG = 0.1 # position cache granularity (degrees)
+YEAR_STEP = 0.1 # date cache granularity (years)
+CACHE_SIZE = 4096
+VALID_YEARS = 5 # a model is valid from its epoch for 5 years
+
+logger = logging.getLogger(__name__)
+
+# WGS 84 ellipsoid and geomagnetic reference radius (km)
+_A = 6378.137
+_B = 6356.7523142
+_RE = 6371.2
+
+class wmmModel():
+    """
+    Spherical harmonic model read from a WMM coefficient file: the Gauss
+    coefficients are stored already Schmidt semi-normalized, indexed [n][m].
+    """
+    def __init__(self, path = WMM_FILE):
+        with open(path) as f:
+            header = f.readline().split()
+            self.epoch = float(header[0])
+            self.name = header[1]
+            rows = []
+            for line in f:
+                items = line.split()
+                if len(items) != 6: # '9999...' trailer
+                    break
+                rows.append((int(items[0]), int(items[1])) + tuple(float(v) for v in items[2:]))
+        self.maxord = max(r[0] for r in rows)
+        size = self.maxord + 1
+        self.g = [[0.0] * size for n in range(size)]
+        self.h = [[0.0] * size for n in range(size)]
+        self.gdot = [[0.0] * size for n in range(size)]
+        self.hdot = [[0.0] * size for n in range(size)]
+        for n, m, g, h, gdot, hdot in rows:
+            self.g[n][m], self.h[n][m], self.gdot[n][m], self.hdot[n][m] = g, h, gdot, hdot
+        # Schmidt semi-normalization factors
+        for n in range(1, size):
+            s = 1.0
+            for k in range(1, n + 1): # S(n,0)
+                s *= (2 * k - 1) / k
+            for m in range(0, n + 1):
+                if m > 0:
+                    s *= sqrt((n - m + 1) * (2 if m == 1 else 1) / (n + m))
+                self.g[n][m] *= s
+                self.h[n][m] *= s
+                self.gdot[n][m] *= s
+                self.hdot[n][m] *= s
+        # recursion factors of the associated Legendre functions
+        self.k = [[0.0] * size for n in range(size)]
+        for n in range(2, size):
+            for m in range(0, n - 1):
+                self.k[n][m] = ((n - 1) ** 2 - m ** 2) / ((2 * n - 1) * (2 * n - 3))
+        self.warned = False
+
+    def checkYear(self, year):
+        # the secular variation is extrapolated outside the model years: warned once
+        if not self.warned and not self.epoch <= year <= self.epoch + VALID_YEARS:
+            self.warned = True
+            logger.warning(self.name + " is valid from " + str(self.epoch) + " to " + str(self.epoch + VALID_YEARS) +
+                           ": declination extrapolated at " + "{:.1f}".format(year) + ", replace " + WMM_FILE)
+
+    def declination(self, lat, lon, year, alt = 0.0):
+        """
+        Declination in radians (East positive) at geodetic lat/lon (degrees),
+        decimal year and altitude (km above the ellipsoid).
+        """
+        self.checkYear(year)
+        dt = year - self.epoch
+        lat = max(-89.9999, min(89.9999, lat)) # the East component is undefined at the poles
+        rlat = lat * pi/180
+        rlon = lon * pi/180
+        srlat = sin(rlat)
+        crlat = cos(rlat)
+        srlat2 = srlat * srlat
+        crlat2 = crlat * crlat
+
+        # geodetic to geocentric spherical coordinates
+        a2 = _A * _A
+        b2 = _B * _B
+        c2 = a2 - b2
+        a4 = a2 * a2
+        c4 = a4 - b2 * b2
+        q = sqrt(a2 - c2 * srlat2)
+        q1 = alt * q
+        q2 = ((q1 + a2) / (q1 + b2)) ** 2
+        ct = srlat / sqrt(q2 * crlat2 + srlat2) # cos/sin of the geocentric colatitude
+        st = sqrt(1.0 - ct * ct)
+        r = sqrt(alt * alt + 2.0 * q1 + (a4 - c4 * srlat2) / (q * q))
+        d = sqrt(a2 * crlat2 + b2 * srlat2)
+        ca = (alt + d) / r
+        sa = c2 * crlat * srlat / (r * d)
+
+        size = self.maxord + 1
+        sp = [0.0] * size
+        cp = [1.0] * size
+        sp[1] = sin(rlon)
+        cp[1] = cos(rlon)
+        for m in range(2, size):
+            sp[m] = sp[1] * cp[m - 1] + cp[1] * sp[m - 1]
+            cp[m] = cp[1] * cp[m - 1] - sp[1] * sp[m - 1]
+
+        p = [[0.0] * size for n in range(size)]
+        dp = [[0.0] * size for n in range(size)]
+        p[0][0] = 1.0
+        aor = _RE / r
+        ar = aor * aor
+        br = bt = bp = 0.0
+        for n in range(1, size):
+            ar *= aor
+            for m in range(0, n + 1):
+                if n == m:
+                    p[n][m] = st * p[n - 1][m - 1]
+                    dp[n][m] = st * dp[n - 1][m - 1] + ct * p[n - 1][m - 1]
+                elif n == 1:
+                    p[n][m] = ct * p[n - 1][m]
+                    dp[n][m] = ct * dp[n - 1][m] - st * p[n - 1][m]
+                else:
+                    p2 = p[n - 2][m] if m <= n - 2 else 0.0
+                    dp2 = dp[n - 2][m] if m <= n - 2 else 0.0
+                    p[n][m] = ct * p[n - 1][m] - self.k[n][m] * p2
+                    dp[n][m] = ct * dp[n - 1][m] - st * p[n - 1][m] - self.k[n][m] * dp2
+                g = self.g[n][m] + dt * self.gdot[n][m]
+                h = self.h[n][m] + dt * self.hdot[n][m]
+                par = ar * p[n][m]
+                temp1 = g * cp[m] + h * sp[m]
+                temp2 = g * sp[m] - h * cp[m]
+                bt -= ar * temp1 * dp[n][m]
+                bp += m * temp2 * par
+                br += (n + 1) * temp1 * par
+        bp /= st
+
+        # rotate back to geodetic North/East components
+        bx = -bt * ca - br * sa
+        by = bp
+        return atan2(by, bx)
+
+_model = None
+
+def model():
+    global _model
+    if _model is None: # coefficients loaded on first use
+        _model = wmmModel()
+    return _model
+
+def decimal_year(date = None):
+    date = date or datetime.date.today()
+    start = datetime.date(date.year, 1, 1)
+    days = (datetime.date(date.year + 1, 1, 1) - start).days
+    return date.year + (date - start).days / days
+
+@lru_cache(maxsize = CACHE_SIZE)
+def _cellDeclination(ilat, ilon, iyear):
+    return model().declination((ilat + 0.5) * CELL_DEG, (ilon + 0.5) * CELL_DEG, iyear * YEAR_STEP)
+
+def declination(lat, lon, year = None):
+    """
+    Declination in radians (East positive) of the 0.1 degree cell containing
+    lat/lon (degrees), at the given decimal year (today if omitted).
+    """
+    if year is None:
+        year = decimal_year()
+    lon = (lon + 180.0) % 360.0 - 180.0
+    return _cellDeclination(int(lat // CELL_DEG), int(lon // CELL_DEG), round(year / YEAR_STEP))